@@ -0,0 +1,96 @@
+import os
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Bounded LRU mapping whose entries also expire after a time-to-live."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def discard_if(self, predicate):
+        for key in [k for k, (_, value) in self._data.items() if predicate(value)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+'''
+Authentication caches
+'''
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+
+# raw JWT -> decoded claims, and username -> user row dict
+token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+user_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+def invalidate_user(id: int):
+    user_cache.discard_if(lambda row: row["id"] == id)
+
+'''
+Task stats cache
+'''
+
+TASK_STATS_TTL = float(os.getenv("TASK_STATS_TTL", 300))
+
+class TaskStatsCache(TTLCache):
+    """Board stats per filter, emptied by every task write.
+
+    The TTL only bounds how long another worker's writes can go unnoticed."""
+
+    generation = 0
+
+    def invalidate(self):
+        self.generation += 1
+        self.clear()
+
+    def set_if_current(self, key, value, generation: int):
+        # a result computed while a write committed may already be stale, don't keep it
+        if generation == self.generation:
+            self.set(key, value)
+
+task_stats_cache = TaskStatsCache(maxsize=256, ttl=TASK_STATS_TTL)
@@ -1,10 +1,16 @@
 import sqlalchemy as sa
 import glob
 from datetime import datetime
-from fastapi import Query
+from fastapi import HTTPException, Query
 from sqlalchemy.ext.asyncio import create_async_engine
 import sqlalchemy.ext.asyncio as ay
 import asyncio
+import os
+import sys
+from cache import task_stats_cache
+from events import bus
+from schemas import TaskProgress
+from pagination import encode_cursor, decode_cursor, decode_datetime
 
 # Database Implementation
 
@@ -32,19 +38,84 @@ task_table = sa.Table(
     sa.Column("name", sa.String),
     sa.Column("progress", sa.String),
     sa.Column("sprint", sa.INTEGER),
-    sa.Column("start_date", sa.DATETIME)
+    sa.Column("start_date", sa.DATETIME),
+    # board stats group by (sprint, progress, day); the index alone answers them
+    sa.Index("ix_task_sprint_progress", "sprint", "progress", "start_date"),
+    # listing: name lookups and prefixes, and the (key, id) orders of TASK_SORT_KEYS (SQLite appends the id to every index)
+    sa.Index("ix_task_name", "name"),
+    sa.Index("ix_task_start_date", "start_date"),
+    sa.Index("ix_task_sprint", "sprint"),
 )
 
+# tasks are returned with their id as task_id, the field name of schemas.Task
+task_columns = [task_table.c.id.label("task_id"), task_table.c.name, task_table.c.progress, task_table.c.sprint, task_table.c.start_date]
+
 engine = None
 
+# PRAGMAs applied to every new SQLite connection; "rollback" is SQLite's stock behaviour
+SQLITE_PROFILES = {
+    "rollback": {},
+    "wal": {
+        "journal_mode": "WAL",          # readers no longer block behind a writer
+        "synchronous": "NORMAL",        # fsync at checkpoints only, safe with WAL
+        "busy_timeout": 5000,           # ms to wait for the write lock before "database is locked"
+        "cache_size": -64000,           # negative = KiB, so 64 MB of page cache per connection
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+}
+
+def sqlite_pragmas() -> dict:
+    profile = os.getenv("DB_PROFILE", "wal")
+    if profile not in SQLITE_PROFILES:
+        raise RuntimeError(f"Unknown DB_PROFILE '{profile}', expected one of {', '.join(SQLITE_PROFILES)}")
+    pragmas = dict(SQLITE_PROFILES[profile])
+    for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store"):
+        value = os.getenv(f"SQLITE_{name.upper()}")
+        if value:
+            pragmas[name] = value
+    return pragmas
+
+def engine_options() -> dict:
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    pool_size = int(os.getenv("DB_POOL_SIZE", max(5, (os.cpu_count() or 1) * 2 // workers)))
+    return {
+        "echo": os.getenv("DB_ECHO", "").lower() in ("1", "true", "yes"),
+        "pool_size": pool_size,
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", pool_size)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+    }
+
 async def create_tables(db_url: str, db_path):
     global engine
-    engine = create_async_engine(db_url, echo=True)
+    engine = create_async_engine(db_url, **engine_options())
+    pragmas = sqlite_pragmas()
+
+    @sa.event.listens_for(engine.sync_engine, "connect")
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
     if len(db_path) < 1:
         async with engine.begin() as conn:
             await conn.run_sync(metadata.create_all)
+    async with engine.begin() as conn:
+        await conn.run_sync(create_missing_indexes)
     return engine
 
+def create_missing_indexes(sync_conn):
+    # indexes declared after an existing database file was created
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
 '''
 User Logic
 '''
@@ -86,29 +157,97 @@ Task Logic
 
 async def get_task(task_id: int):
     async with engine.connect() as conn:
-        stmt = sa.select(task_table).where(task_table.c.id == task_id)
-        result = await conn.execute(stmt).first()
-        return result._asdict() if result else None
+        stmt = sa.select(*task_columns).where(task_table.c.id == task_id)
+        result = (await conn.execute(stmt)).mappings().first()
+        return result
     
 
 async def insert_task(name: str, progress:str, sprint: int, date: datetime):
     async with engine.begin() as conn:
-        await conn.execute(sa.insert(task_table).values(name = name, progress = progress, sprint = sprint, start_date = date))
+        res = await conn.execute(sa.insert(task_table).values(name = name, progress = progress, sprint = sprint, start_date = date).returning(task_table.c.id))
+        id = res.scalar_one()
+    task_stats_cache.invalidate()
+    publish_task("created", id, sprint)
+
+TASK_SORT_KEYS = {
+    "id": task_table.c.id,
+    "start_date": task_table.c.start_date,
+    "sprint": task_table.c.sprint,
+}
+
+async def get_tasks(name: str = None, sprint: int = None, progress: str = None, name_prefix: str = None,
+                    since: datetime = None, until: datetime = None, sort: str = "id", descending: bool = False,
+                    limit: int = 100, cursor: str = None):
+    # keyset pagination in (sort key, id) order; returns the page's RowMappings and the cursor of the next page, if any
+    key = TASK_SORT_KEYS[sort]
+    conditions = task_conditions(name, sprint, progress, name_prefix, since, until)
+    stmt = sa.select(*task_columns).where(*conditions)
+    last_value, last_id = decode_task_cursor(key, cursor) if cursor else (None, None)
 
-async def get_tasks(name: str = None, sprint: int = None, progress: str = None):
+    order = [task_table.c.id] if key is task_table.c.id else [key, task_table.c.id]
+    page = stmt.where(task_cursor_condition(key, descending, last_value, last_id)) if cursor else stmt
+    page = page.order_by(*(column.desc() for column in order) if descending else order).limit(limit)
     async with engine.connect() as conn:
-        stmt = sa.select(task_table)
-        conditions = []
-        if name is not None:
-            conditions.append(task_table.c.name == name)
-        if progress is not None:
-            conditions.append(task_table.c.progress == progress)
-        if sprint is not None:
-            conditions.append(task_table.c.sprint == sprint)
-        if conditions:
-            stmt = stmt.where(sa.and_(*conditions))
-        result = await conn.execute(stmt)
-        return result.all()
+        rows = (await conn.execute(page)).mappings().all()
+        if cursor and descending and last_value is not None and len(rows) < limit:
+            # NULL keys sort after every value descending; fetching them apart keeps the query above an index range
+            rest = stmt.where(key.is_(None)).order_by(task_table.c.id.desc()).limit(limit - len(rows))
+            rows += (await conn.execute(rest)).mappings().all()
+    next_cursor = None
+    if limit and len(rows) == limit:
+        last = rows[-1]
+        next_cursor = encode_cursor(last[key.name] if key is not task_table.c.id else None, last["task_id"])
+    return rows, next_cursor
+
+def prefix_upper_bound(prefix: str) -> str | None:
+    # smallest string above every name starting with prefix (SQLite compares in code point order);
+    # None when the prefix is all U+10FFFF, which has no successor
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    next_char = ord(prefix[-1]) + 1
+    if 0xD800 <= next_char <= 0xDFFF:
+        next_char = 0xE000 # surrogates can't be stored
+    return prefix[:-1] + chr(next_char)
+
+def task_conditions(name: str = None, sprint: int = None, progress: str = None, name_prefix: str = None,
+                    since: datetime = None, until: datetime = None) -> list:
+    conditions = []
+    if name is not None:
+        conditions.append(task_table.c.name == name)
+    if name_prefix:
+        # a range rather than LIKE, so ix_task_name is used; case-sensitive like name itself
+        conditions.append(task_table.c.name >= name_prefix)
+        upper = prefix_upper_bound(name_prefix)
+        if upper is not None:
+            conditions.append(task_table.c.name < upper)
+    if progress is not None:
+        conditions.append(task_table.c.progress == progress)
+    if sprint is not None:
+        conditions.append(task_table.c.sprint == sprint)
+    if since is not None:
+        conditions.append(task_table.c.start_date >= since)
+    if until is not None:
+        conditions.append(task_table.c.start_date < until)
+    return conditions
+
+def decode_task_cursor(key, cursor: str):
+    last_value, last_id = decode_cursor(cursor, 2)
+    if not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if key is task_table.c.start_date and last_value is not None:
+        last_value = decode_datetime(last_value)
+    return last_value, last_id
+
+def task_cursor_condition(key, descending: bool, last_value, last_id: int):
+    after = (lambda a, b: a < b) if descending else (lambda a, b: a > b)
+    if key is task_table.c.id:
+        return after(task_table.c.id, last_id)
+    if last_value is None:
+        # SQLite sorts NULL keys first: ascending every value still follows them, descending nothing does
+        null_rows = sa.and_(key.is_(None), after(task_table.c.id, last_id))
+        return null_rows if descending else sa.or_(null_rows, key.is_not(None))
+    return after(sa.tuple_(key, task_table.c.id), sa.tuple_(last_value, last_id))
 
 async def update_task(id: int, name: str = None, progress: str = None, sprint: int = None):
     async with engine.begin() as conn:
@@ -119,10 +258,121 @@ async def update_task(id: int, name: str = None, progress: str = None, sprint: i
             cont["progress"] = progress
         if sprint is not None:
             cont["sprint"] = sprint
-        res = await conn.execute(sa.update(task_table).where(task_table.c.id == id).values(cont))
-        return res.rowcount > 0
+        # the old sprint too, so its subscribers hear about a task moving away
+        old_sprint = await conn.scalar(sa.select(task_table.c.sprint).where(task_table.c.id == id))
+        res = await conn.execute(sa.update(task_table).where(task_table.c.id == id).values(cont).returning(task_table.c.sprint))
+        updated = res.first()
+    task_stats_cache.invalidate()
+    if updated is None:
+        return False
+    publish_task("updated", id, old_sprint, updated.sprint)
+    return True
 
 async def delete_task(id: int):
     async with engine.begin() as conn:
-        res = await conn.execute(sa.delete(task_table).where(task_table.c.id == id))
-        return res.rowcount > 0
\ No newline at end of file
+        res = await conn.execute(sa.delete(task_table).where(task_table.c.id == id).returning(task_table.c.sprint))
+        deleted = res.all()
+    task_stats_cache.invalidate()
+    if deleted:
+        publish_task("deleted", id, deleted[0].sprint)
+    return bool(deleted)
+
+async def get_task_stats(sprint: int = None) -> dict:
+    # a single GROUP BY over ix_task_sprint_progress; every rollup below is summed from its rows
+    day = sa.func.date(task_table.c.start_date).label("day")
+    stmt = (
+        sa.select(task_table.c.sprint, task_table.c.progress, day, sa.func.count().label("tasks"))
+        .group_by(task_table.c.sprint, task_table.c.progress, day)
+    )
+    if sprint is not None:
+        stmt = stmt.where(task_table.c.sprint == sprint)
+    async with engine.connect() as conn:
+        rows = (await conn.execute(stmt)).all()
+
+    sprints = {}
+    for row in rows:
+        entry = sprints.setdefault(row.sprint, {"sprint": row.sprint, "counts": dict.fromkeys(TaskProgress, 0), "days": {}})
+        entry["counts"][row.progress] = entry["counts"].get(row.progress, 0) + row.tasks
+        if row.day is not None:
+            added_done = entry["days"].setdefault(row.day, [0, 0])
+            added_done[0] += row.tasks
+            if row.progress == "done":
+                added_done[1] += row.tasks
+
+    counts = dict.fromkeys(TaskProgress, 0)
+    for entry in sprints.values():
+        for progress, tasks in entry["counts"].items():
+            counts[progress] = counts.get(progress, 0) + tasks
+        # tasks record no completion date, so the series follows start_date: what was added by each day and how much of it is still open
+        added = done = 0
+        burndown = []
+        for date, (day_added, day_done) in sorted(entry.pop("days").items()):
+            added += day_added
+            done += day_done
+            burndown.append({"date": date, "added": day_added, "done": day_done, "remaining": added - done})
+        entry["burndown"] = burndown
+        entry.update(rollup(entry["counts"]))
+    return {"counts": counts, **rollup(counts), "sprints": sorted(sprints.values(), key=lambda e: (e["sprint"] is None, e["sprint"]))}
+
+def rollup(counts: dict) -> dict:
+    total = sum(counts.values())
+    return {"total": total, "completion": round(counts.get("done", 0) / total, 4) if total else 0.0}
+
+'''
+Bulk task logic
+'''
+
+async def insert_tasks(tasks: list[dict]) -> list[int]:
+    # one executemany INSERT ... RETURNING, ids come back in the order of tasks
+    async with engine.begin() as conn:
+        result = await conn.execute(sa.insert(task_table).returning(task_table.c.id, sort_by_parameter_order=True), tasks)
+        ids = result.scalars().all()
+    task_stats_cache.invalidate()
+    publish_sprints("created", [(id, task["sprint"]) for id, task in zip(ids, tasks)])
+    return ids
+
+async def update_tasks(patches: dict[int, dict]) -> set[int]:
+    # tasks getting the same changes share one UPDATE ... WHERE id IN, so moving a sprint's tasks is a single statement;
+    # returns the ids that existed
+    groups = {}
+    for id, cont in patches.items():
+        groups.setdefault(tuple(sorted(cont.items(), key=lambda item: item[0])), []).append(id)
+    updated = {} # id -> new sprint
+    moved = []
+    async with engine.begin() as conn:
+        if any("sprint" in cont for cont in patches.values()):
+            moved = (await conn.execute(sa.select(task_table.c.id, task_table.c.sprint).where(task_table.c.id.in_(patches)))).all()
+        for cont, ids in groups.items():
+            stmt = sa.update(task_table).where(task_table.c.id.in_(ids)).values(dict(cont)).returning(task_table.c.id, task_table.c.sprint)
+            updated.update((await conn.execute(stmt)).all())
+    task_stats_cache.invalidate()
+    publish_sprints("updated", [*updated.items(), *moved])
+    return set(updated)
+
+async def delete_tasks(ids: list[int] = None, conditions: list = None) -> list[int]:
+    # by ids, or everything matching task_conditions(); returns the deleted ids
+    stmt = sa.delete(task_table).where(task_table.c.id.in_(ids) if ids is not None else sa.and_(*conditions)).returning(task_table.c.id, task_table.c.sprint)
+    async with engine.begin() as conn:
+        deleted = (await conn.execute(stmt)).all()
+    task_stats_cache.invalidate()
+    publish_sprints("deleted", deleted)
+    return [id for id, _ in deleted]
+
+'''
+Change feed
+'''
+
+# published once the write transaction has committed; topics are "tasks" and "sprint:<n>:tasks"
+
+def publish_task(type: str, id: int, *sprints: int):
+    topics = ["tasks", *(f"sprint:{sprint}:tasks" for sprint in dict.fromkeys(sprints) if sprint is not None)]
+    bus.publish(f"task.{type}", topics, f"task:{id}", {"id": id, "sprint": sprints[-1]})
+
+def publish_sprints(type: str, tasks: list[tuple[int, int]]):
+    # bulk writes send one event per sprint they touched, with the ids, rather than one per task;
+    # they coalesce per sprint, so clients treat them as a cue to refetch that sprint
+    ids_by_sprint = {}
+    for id, sprint in tasks:
+        ids_by_sprint.setdefault(sprint, set()).add(id)
+    for sprint, ids in ids_by_sprint.items():
+        bus.publish(f"tasks.{type}", ["tasks", f"sprint:{sprint}:tasks"], f"sprint:{sprint}", {"sprint": sprint, "ids": sorted(ids)})
\ No newline at end of file
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+import uuid
+from collections import OrderedDict, deque
+
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", 10000))  # recent events kept for resuming clients
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 1000))     # undelivered events per subscriber before it is reset
+EVENT_HEARTBEAT = float(os.getenv("EVENT_HEARTBEAT", 15))       # seconds between keep-alives on an idle stream
+
+def coalesce(earlier: str, later: str) -> str:
+    # type of two events about one object merged into one; a creation the client hasn't seen yet stays a creation
+    if earlier.endswith(".created") and later.endswith(".updated"):
+        return earlier
+    return later
+
+class Subscription:
+    """One client's pending events. Newer events about the same object replace older ones, and a
+    subscriber that still falls EVENT_QUEUE_SIZE behind loses its backlog for a single "reset" event."""
+
+    def __init__(self, topics: set[str], maxsize: int):
+        self.topics = topics
+        self.maxsize = maxsize
+        self.pending = OrderedDict() # event key -> event, in sequence order
+        self.reset = False
+        self.ready = asyncio.Event()
+
+    def offer(self, event: dict):
+        previous = self.pending.pop(event["key"], None)
+        if previous is not None and coalesce(previous["type"], event["type"]) != event["type"]:
+            event = {**event, "type": previous["type"]}
+        if len(self.pending) >= self.maxsize:
+            self.pending.clear()
+            self.reset = True
+        else:
+            self.pending[event["key"]] = event
+        self.ready.set()
+
+    async def next(self, timeout: float) -> list[dict]:
+        # waits up to timeout; an empty list means nothing happened and a keep-alive is due
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        events = list(self.pending.values())
+        self.pending.clear()
+        if self.reset:
+            self.reset = False
+            events.insert(0, None)
+        return events
+
+class EventBus:
+    """In-process pub/sub. Sequence numbers are per process, so event ids carry a stream id:
+    a client resuming against another worker or after a restart is told to reset."""
+
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE, queue_size: int = EVENT_QUEUE_SIZE):
+        self.stream = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.buffer = deque(maxlen=buffer_size)
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.published = 0
+
+    def publish(self, type: str, topics: list[str], key: str, data: dict):
+        self.seq += 1
+        self.published += 1
+        event = {"id": f"{self.stream}:{self.seq}", "seq": self.seq, "type": type, "topics": topics, "key": key, "data": data}
+        self.buffer.append(event)
+        for subscription in self.subscribers:
+            if subscription.topics.intersection(topics):
+                subscription.offer(event)
+
+    def subscribe(self, topics: set[str], last_event_id: str | None = None) -> Subscription:
+        subscription = Subscription(topics, self.queue_size)
+        if last_event_id:
+            stream, _, seq = last_event_id.partition(":")
+            oldest = self.buffer[0]["seq"] if self.buffer else self.seq + 1
+            if stream != self.stream or not seq.isdigit() or int(seq) < oldest - 1:
+                subscription.reset = True # events were missed that the buffer no longer holds
+                subscription.ready.set()
+            else:
+                for event in self.buffer:
+                    if event["seq"] > int(seq) and topics.intersection(event["topics"]):
+                        subscription.offer(event)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+
+    def reset_event(self) -> dict:
+        # tells the client to refetch what it shows, and where to resume from afterwards
+        return {"id": f"{self.stream}:{self.seq}", "type": "reset", "data": {}}
+
+    def stats(self) -> dict:
+        return {
+            "stream": self.stream,
+            "seq": self.seq,
+            "published": self.published,
+            "buffered": len(self.buffer),
+            "subscribers": len(self.subscribers),
+        }
+
+bus = EventBus()
+
+def parse_topics(topics: str) -> set[str]:
+    return {topic.strip() for topic in topics.split(",") if topic.strip()}
+
+'''
+Stream formats
+'''
+
+def message(bus: EventBus, event: dict | None) -> dict:
+    if event is None:
+        return bus.reset_event()
+    return {"id": event["id"], "type": event["type"], "data": event["data"]}
+
+async def sse_stream(bus: EventBus, subscription: Subscription):
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            events = await subscription.next(EVENT_HEARTBEAT)
+            if not events:
+                yield ": keep-alive\n\n"
+            for event in events:
+                msg = message(bus, event)
+                yield f"id: {msg['id']}\nevent: {msg['type']}\ndata: {json.dumps(msg['data'], separators=(',', ':'))}\n\n"
+    finally:
+        bus.unsubscribe(subscription)
+
+async def websocket_stream(bus: EventBus, subscription: Subscription, websocket):
+    try:
+        while True:
+            events = await subscription.next(EVENT_HEARTBEAT)
+            if not events:
+                await websocket.send_json({"type": "keep-alive"})
+            for event in events:
+                await websocket.send_json(message(bus, event))
+    finally:
+        bus.unsubscribe(subscription)
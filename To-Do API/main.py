@@ -1,6 +1,8 @@
-import fastapi, glob
-from fastapi import FastAPI, Depends
-from typing import List, Optional
+import fastapi, glob, json
+from fastapi import FastAPI, Body, Depends, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from typing import Any, List, Optional
 from fastapi import HTTPException
 from datetime import datetime
 from fastapi.security import OAuth2PasswordRequestForm
@@ -9,6 +11,8 @@ import db
 from enum import Enum
 from password import *
 from schemas import *
+from cache import invalidate_user, token_cache, user_cache, task_stats_cache
+from events import bus, parse_topics, sse_stream, websocket_stream
 
 load_dotenv()  # This loads variables from .env file into os.environ
 
@@ -24,8 +28,13 @@ app = FastAPI()
 
 @app.on_event("startup")
 async def startup_event():
+    password_hasher.start()
     await db.create_tables(db_async_url, db_path)
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    password_hasher.shutdown()
+
 '''
 Password Authentication Logic
 '''
@@ -58,7 +67,7 @@ async def db_user(id: int, current_user: dict = fastapi.Depends(require_role("ad
 # This route calls an async function
 @app.post("/register")
 async def registration(user: User):
-    await db.insert_user(user.username, hash_password(user.password), role=user.role)
+    await db.insert_user(user.username, await hash_password_async(user.password), role=user.role)
     return {"message": "User created"}
 
 
@@ -70,7 +79,7 @@ async def login(requests_form = Depends(OAuth2PasswordRequestForm)):
     if not user_info:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    if verify_password(requests_form.password, user_info['password']):
+    if await verify_password_async(requests_form.password, user_info['password']):
         token = create_access_token({"sub": str(requests_form.username), "role": user_info['role']})
         return {"access_token": token, "token_type": "bearer"}
 
@@ -78,6 +87,15 @@ async def login(requests_form = Depends(OAuth2PasswordRequestForm)):
 
 
 
+@app.get("/admin/metrics")
+async def admin_metrics(current_user: dict = fastapi.Depends(require_role("admin"))):
+    return {
+        "password_hashing": password_hasher.stats(),
+        "auth_cache": {"tokens": token_cache.stats(), "users": user_cache.stats()},
+        "task_stats_cache": task_stats_cache.stats(),
+        "events": bus.stats(),
+    }
+
 @app.get("/me", response_model=UserProfile)
 async def get_user_role(current_user: dict = fastapi.Depends(get_current_user)):
     return current_user
@@ -93,19 +111,24 @@ async def update_user(user_id:int, user_update: UserUpdate):
         if user_update.name is not None:
             cont["name"] = user_update.name
         if user_update.password is not None:
-            cont["password"] = hash_password(user_update.password)
+            cont["password"] = await hash_password_async(user_update.password)
 
         updated = await db.update_user(user_id, cont)
+        invalidate_user(user_id)
         if not updated:
             raise HTTPException(status_code=404, detail="User not found")
         return {"message": "User updated"}
+    except HTTPException:
+        raise
     except:
         raise HTTPException(status_code=404, detail="User not found")
 
 # This route calls an async function
 @app.delete("/users/{user_id}", dependencies=[Depends(require_role("admin"))])
 async def delete_user(user_id: int):
-    if not await db.delete_user(user_id):
+    deleted = await db.delete_user(user_id)
+    invalidate_user(user_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted"}
 
@@ -120,6 +143,57 @@ class TaskProgress(str, Enum):
 
 
 
+# Declared before /tasks/{task_id}, which would otherwise try to read "stats" as an id
+@app.get("/tasks/stats", response_model=TaskStats)
+async def get_task_stats(sprint: Optional[int] = None, current_user: dict = fastapi.Depends(get_current_user)):
+    generation = task_stats_cache.generation
+    stats = task_stats_cache.get(sprint)
+    if stats is None:
+        stats = await db.get_task_stats(sprint)
+        task_stats_cache.set_if_current(sprint, stats, generation)
+    return stats
+
+# Bulk routes are declared before /tasks/{task_id} for the same reason
+@app.post("/tasks/bulk", response_model=List[TaskBulkResult], dependencies=[fastapi.Depends(require_role("admin"))])
+async def post_tasks(tasks: List[dict[str, Any]] = Body(..., max_length=TASK_BULK_MAX)):
+    # items are validated one by one so a bad one is reported instead of failing the whole request
+    results, rows = [], []
+    for index, raw in enumerate(tasks):
+        try:
+            task = Task.model_validate(raw)
+        except ValidationError as e:
+            results.append({"index": index, "status": "invalid", "detail": json.loads(e.json(include_url=False))})
+            continue
+        rows.append((index, {"name": task.name, "progress": task.progress, "sprint": task.sprint, "start_date": task.start_date or datetime.utcnow()}))
+    if rows:
+        ids = await db.insert_tasks([row for _, row in rows])
+        results += [{"index": index, "task_id": id, "status": "created"} for (index, _), id in zip(rows, ids)]
+    return sorted(results, key=lambda r: r["index"])
+
+@app.patch("/tasks/bulk", response_model=List[TaskBulkResult], dependencies=[fastapi.Depends(require_role("admin"))])
+async def update_tasks(bulk: TaskBulkUpdate):
+    ids = [item.id for item in bulk.items]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Each task may only appear once per request")
+    patches = {item.id: item.fields.model_dump(exclude_unset=True) for item in bulk.items}
+    updated = await db.update_tasks({id: cont for id, cont in patches.items() if cont})
+    return [
+        {"index": index, "task_id": id, "status": "invalid", "detail": "No fields to update"} if not patches[id]
+        else {"index": index, "task_id": id, "status": "updated" if id in updated else "not_found"}
+        for index, id in enumerate(ids)
+    ]
+
+@app.delete("/tasks/bulk", response_model=List[TaskBulkResult], dependencies=[fastapi.Depends(require_role("admin"))])
+async def delete_tasks(bulk: TaskBulkDelete):
+    if bulk.ids is not None:
+        deleted = set(await db.delete_tasks(ids=bulk.ids))
+        return [{"index": index, "task_id": id, "status": "deleted" if id in deleted else "not_found"} for index, id in enumerate(bulk.ids)]
+    conditions = db.task_conditions(**bulk.filter.model_dump()) if bulk.filter is not None else []
+    if not conditions:
+        raise HTTPException(status_code=400, detail="Give ids or at least one filter, deleting every task is not supported")
+    deleted = await db.delete_tasks(conditions=conditions)
+    return [{"index": index, "task_id": id, "status": "deleted"} for index, id in enumerate(sorted(deleted))]
+
 # This route calls an async function
 @app.get("/tasks/{task_id}", response_model=Task)
 async def get_task(task_id: int, current_user: dict = fastapi.Depends(get_current_user)):
@@ -130,18 +204,23 @@ async def get_task(task_id: int, current_user: dict = fastapi.Depends(get_curren
 
 # This route calls an async function
 @app.get("/tasks", response_model=List[Task])
-async def get_tasks(name: str = None, sprint: Optional[int] = None, progress: Optional[str] = None):
-    result = await db.get_tasks(name, sprint, progress)
-    tasks = [
-        {
-            "task_id": r.id,
-            "name": r.name,
-            "progress": r.progress,
-            "sprint": r.sprint,
-            "start_date": r.start_date
-        }
-        for r in result
-    ]
+async def get_tasks(
+    response: Response,
+    name: str = None,
+    sprint: Optional[int] = None,
+    progress: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+    since: Optional[datetime] = None,  # start_date >= since
+    until: Optional[datetime] = None,  # start_date < until
+    sort: TaskSort = TaskSort.id,
+    descending: bool = False,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,  # from X-Next-Cursor, continues the same filters and sort
+):
+    # RowMappings already carry the Task fields, response_model validates them as they are
+    tasks, next_cursor = await db.get_tasks(name, sprint, progress, name_prefix, since, until, sort.value, descending, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return tasks
 
 # This route calls an async function
@@ -176,3 +255,31 @@ async def delete_task(task_id: int):
         await db.delete_task(task_id)
     except:
         raise HTTPException(status_code=404, detail="Task not found")
+
+'''
+Change feed
+'''
+
+# EventSource can't set headers, so both streams take the token as ?token= like get_current_user already allows
+@app.get("/events")
+async def event_stream(
+    request: Request,
+    topics: str = Query(..., description="Comma separated, e.g. tasks,sprint:3:tasks"),
+    last_event_id: Optional[str] = None, # resumes after this event; browsers send the Last-Event-ID header instead
+    current_user: dict = fastapi.Depends(get_current_user),
+):
+    subscription = bus.subscribe(parse_topics(topics), request.headers.get("last-event-id") or last_event_id)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(sse_stream(bus, subscription), media_type="text/event-stream", headers=headers)
+
+@app.websocket("/ws/events")
+async def event_socket(websocket: WebSocket, topics: str, token: str = None, last_event_id: Optional[str] = None):
+    try:
+        await get_current_user(None, token)
+    except HTTPException:
+        return await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+    await websocket.accept()
+    try:
+        await websocket_stream(bus, bus.subscribe(parse_topics(topics), last_event_id), websocket)
+    except WebSocketDisconnect:
+        pass
@@ -1,3 +1,6 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from dotenv import load_dotenv
@@ -6,6 +9,7 @@ from passlib.exc import UnknownHashError
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi import FastAPI, Query, Security, Depends, HTTPException
 from db import get_users
+from cache import token_cache, user_cache
 import os
 
 load_dotenv()
@@ -40,7 +44,95 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         print(f"An unexpected error occurred during password verification: {e}")
         return False
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+'''
+Off-loop password hashing
+'''
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop with a bounded number of pending jobs.
+
+    mode is "process" (dedicated worker processes), "thread" (bcrypt releases
+    the GIL while hashing) or "inline" (run on the caller, for debugging).
+    """
+
+    def __init__(self, mode: str = "process", workers: int = 2, max_pending: int = 8):
+        self.mode = mode
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._executor = None
+
+    def start(self):
+        if self._executor is None and self.mode == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        elif self._executor is None and self.mode == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Too many password operations in progress", headers={"Retry-After": "1"})
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        started = time.perf_counter()
+        try:
+            if self.mode == "inline":
+                return fn(*args)
+            self.start()
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.pending -= 1
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_latency_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            "max_latency_ms": round(self.max_seconds * 1000, 2),
+        }
+
+_workers = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+password_hasher = PasswordHasher(
+    mode=os.getenv("PASSWORD_HASH_MODE", "process"),
+    workers=_workers,
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", _workers * 4)),
+)
+
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.run(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(verify_password, plain_password, hashed_password)
+
+# auto_error off so a ?token= query parameter alone authenticates (EventSource clients cannot set headers)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
+
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, env_vars['SECRET_KEY'], algorithms=[env_vars['ALGORITHM']])
+        # never keep a token around longer than it is valid
+        token_cache.set(token, payload, ttl=payload.get("exp", 0) - time.time())
+    return payload
 
 # This function now needs to be async because it calls db.get_users
 async def get_current_user(
@@ -48,16 +140,21 @@ async def get_current_user(
     token_q: str = Query(None, alias="token")
 ):
     token = token_q or token  # prefer query token if provided
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
     try:
-        payload = jwt.decode(token, env_vars['SECRET_KEY'], algorithms=[env_vars['ALGORITHM']])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         # This is now an async call and needs to be awaited
-        user = await get_users(name=username)
-        if not user:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
+        user = user_cache.get(username)
+        if user is None:
+            user = await get_users(name=username)
+            if not user:
+                raise HTTPException(status_code=401, detail="Invalid credentials")
+            user_cache.set(username, user)
         return {"username": username, "role": payload.get("role")}
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, ConfigDict
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Any, Optional
+from datetime import date, datetime
 from enum import Enum
 
 class User(BaseModel):
@@ -23,6 +23,11 @@ class TaskProgress(str, Enum):
     in_progress = "in-progress"
     done = "done"
     
+class TaskSort(str, Enum):
+    id = "id"
+    start_date = "start_date"
+    sprint = "sprint"
+
 class Task(BaseModel):
     task_id: Optional[int] = None
     name: str
@@ -31,4 +36,59 @@ class Task(BaseModel):
     start_date: Optional[datetime] = None
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
-    
\ No newline at end of file
+    
+
+class BurndownPoint(BaseModel):
+    date: date
+    added: int
+    done: int
+    remaining: int
+
+class SprintStats(BaseModel):
+    sprint: Optional[int] = None
+    counts: dict[TaskProgress, int]
+    total: int
+    completion: float
+    burndown: list[BurndownPoint]
+
+class TaskStats(BaseModel):
+    counts: dict[TaskProgress, int]
+    total: int
+    completion: float
+    sprints: list[SprintStats]
+
+
+# bulk endpoints, each applied in one transaction
+TASK_BULK_MAX = 5000
+
+class TaskPatch(BaseModel):
+    name: Optional[str] = None
+    progress: Optional[TaskProgress] = None
+    sprint: Optional[int] = None
+    start_date: Optional[datetime] = None
+
+class TaskBulkUpdateItem(BaseModel):
+    id: int
+    fields: TaskPatch
+
+class TaskBulkUpdate(BaseModel):
+    items: list[TaskBulkUpdateItem] = Field(max_length=TASK_BULK_MAX)
+
+class TaskFilter(BaseModel):
+    # the filters of GET /tasks
+    name: Optional[str] = None
+    name_prefix: Optional[str] = None
+    sprint: Optional[int] = None
+    progress: Optional[TaskProgress] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+class TaskBulkDelete(BaseModel):
+    ids: Optional[list[int]] = Field(None, max_length=TASK_BULK_MAX)
+    filter: Optional[TaskFilter] = None
+
+class TaskBulkResult(BaseModel):
+    index: int  # position in the request (for a filter delete, in the deleted tasks)
+    task_id: Optional[int] = None
+    status: str  # created, updated, deleted, not_found or invalid
+    detail: Any = None
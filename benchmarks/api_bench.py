@@ -0,0 +1,513 @@
+"""Route-by-route benchmark of the blog API or the To-Do API.
+
+Seeds a throwaway SQLite database with realistic data, then drives every
+route in the app's main.py (--routes narrows it with a regex) with
+--concurrency clients, either in-process through an ASGI transport or
+against a real uvicorn process. For every route it reports status codes,
+throughput and p50/p95/p99 latency, plus SQL statements per request
+(counted in-process, or read from the blog's Server-Timing header). The
+JSON result includes the git commit and peak RSS so runs can be diffed
+across commits:
+
+    python benchmarks/api_bench.py --app blog --mode asgi --output before.json
+    git checkout my-branch
+    python benchmarks/api_bench.py --app blog --mode asgi --compare before.json
+    python benchmarks/api_bench.py --app todo --mode uvicorn --concurrency 50
+    python benchmarks/api_bench.py --app blog --env RESPONSE_CACHE_TTL=0 --routes "GET /posts"
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Optional
+
+import httpx
+from jose import jwt
+from passlib.context import CryptContext
+
+from blog_concurrency import ENV, percentile, wait_until_up
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIRS = {"blog": ROOT / "blog_api" / "app", "todo": ROOT / "To-Do API"}
+PASSWORD = "benchmark-password"
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+@dataclass
+class Route:
+    method: str
+    path: str                                   # the route template, as declared in main.py
+    url: Callable[[int], str]                   # i -> concrete URL for the i-th request
+    body: Optional[Callable[[int], dict]] = None
+    form: Optional[Callable[[int], dict]] = None
+    auth: Optional[str] = None                  # None, "user" or "admin"
+    headers: Optional[Callable[[int], dict]] = None # per-request headers, e.g. a token only this request uses
+    destructive: bool = False                   # run after every other route
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.path}"
+
+
+@dataclass
+class Sizes:
+    users: int = 50
+    categories: int = 10
+    tags: int = 50
+    posts: int = 2000
+    comments_per_post: int = 3
+    sprints: int = 20
+    tasks: int = 2000
+    victims: int = 500                          # extra rows reserved for DELETE routes
+    rng: random.Random = field(default_factory=lambda: random.Random(7))
+
+
+def timestamp(days_ago: float) -> str:
+    return (datetime(2025, 1, 1) - timedelta(days=days_ago)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def token(sub: str, role: str, uid: int, **extra) -> str:
+    # both apps seed admin and author as users 1 and 2
+    claims = {"sub": sub, "role": role, "uid": uid, "exp": datetime.utcnow() + timedelta(hours=2), **extra}
+    return jwt.encode(claims, ENV["SECRET_KEY"], algorithm=ENV["ALGORITHM"])
+
+
+'''
+Blog API
+'''
+
+def seed_blog(db_file: Path, sizes: Sizes):
+    rng = sizes.rng
+    password_hash = CryptContext(schemes=["bcrypt"]).hash(PASSWORD)
+    words = [f"word{i}" for i in range(2000)]
+    con = sqlite3.connect(db_file)
+    con.executemany(
+        "INSERT INTO users (username, email, password_hash, first_name, last_name, bio, created_at, is_admin) VALUES (?, ?, ?, 'Bench', ?, 'bio', ?, ?)",
+        [(name, f"{name}@example.com", password_hash, name, timestamp(400), name == "admin")
+         for name in ["admin", "author"] + [f"user{i}" for i in range(sizes.users)] + [f"victim{i}" for i in range(sizes.victims)]],
+    )
+    con.executemany("INSERT INTO categories (name, slug) VALUES (?, ?)", [(f"Category {i}", f"category-{i}") for i in range(sizes.categories + sizes.victims)])
+    con.executemany("INSERT INTO tags (name) VALUES (?)", [(f"tag{i}",) for i in range(sizes.tags + sizes.victims)])
+    total_posts = sizes.posts + sizes.victims
+    con.executemany(
+        "INSERT INTO posts (title, slug, content, status, publication_date, updated_at, author_id, category_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(" ".join(rng.choices(words, k=6)), f"post-{i}", " ".join(rng.choices(words, k=120)),
+          "published" if rng.random() < 0.8 else "draft", timestamp(total_posts - i), timestamp(0),
+          2 + rng.randrange(sizes.users), 1 + rng.randrange(sizes.categories))
+         for i in range(1, total_posts + 1)],
+    )
+    con.executemany(
+        "INSERT INTO tag_post_association (post_id, tag_id) VALUES (?, ?)",
+        [(post_id, tag_id) for post_id in range(1, total_posts + 1) for tag_id in rng.sample(range(1, sizes.tags + 1), 3)],
+    )
+    con.executemany(
+        "INSERT INTO comments (content, created_at, updated_at, author_id, post_id) VALUES (?, ?, ?, ?, ?)",
+        [(" ".join(rng.choices(words, k=20)), timestamp(1), timestamp(1), 2 + rng.randrange(sizes.users), 1 + i % sizes.posts)
+         for i in range(sizes.posts * sizes.comments_per_post + sizes.victims)],
+    )
+    # top-level comments; the API fills in the materialized path for the ones it creates itself
+    con.execute("UPDATE comments SET path = printf('%010d/', id) WHERE path IS NULL")
+    con.commit()
+    con.close()
+
+
+def blog_routes(sizes: Sizes) -> list[Route]:
+    post = lambda i: 1 + i % sizes.posts
+    victim_post = lambda i: sizes.posts + 1 + i % sizes.victims
+    comment = lambda i: 1 + i % (sizes.posts * sizes.comments_per_post)
+    victim_comment = lambda i: sizes.posts * sizes.comments_per_post + 1 + i % sizes.victims
+    category = lambda i: 1 + i % sizes.categories
+    tag = lambda i: 1 + i % sizes.tags
+    run = f"{time.time_ns():x}" # keeps generated unique names unique across repeated runs
+    post_body = lambda i: {"title": f"Bench post {i}", "slug": None, "content": "Benchmark content " * 20, "status": "published", "category_id": category(i), "author_id": 2}
+    return [
+        Route("GET", "/", lambda i: "/"),
+        Route("POST", "/login", lambda i: "/login", form=lambda i: {"username": "author", "password": PASSWORD}),
+        Route("POST", "/logout", lambda i: "/logout", headers=lambda i: {"Authorization": f"Bearer {token('author', 'user', 2, jti=f'{run}-{i}')}"}),
+        Route("POST", "/users/", lambda i: "/users/", auth="admin", body=lambda i: {"username": f"new-{run}-{i}", "email": f"new-{run}-{i}@example.com", "password": PASSWORD, "first_name": None, "last_name": None, "bio": None}),
+        Route("GET", "/users/{username}", lambda i: f"/users/user{i % sizes.users}"),
+        Route("PUT", "/users/{username}", lambda i: f"/users/user{i % sizes.users}", auth="admin", body=lambda i: {"bio": f"updated {i}"}),
+        Route("DELETE", "/users/{username}", lambda i: f"/users/victim{i % sizes.victims}", auth="admin", destructive=True),
+        Route("GET", "/users/", lambda i: "/users/", auth="admin"),
+        Route("GET", "/admin/metrics", lambda i: "/admin/metrics", auth="admin"),
+        Route("POST", "/admin/counters/rebuild", lambda i: "/admin/counters/rebuild", auth="admin"),
+        Route("GET", "/metrics", lambda i: "/metrics"),
+        Route("GET", "/me", lambda i: "/me", auth="user"),
+        Route("POST", "/posts/", lambda i: "/posts/", auth="user", body=post_body),
+        Route("POST", "/posts/bulk", lambda i: "/posts/bulk", auth="admin", body=lambda i: [{**post_body(i * 20 + j), "tags": [f"tag{j}"]} for j in range(20)]),
+        Route("GET", "/posts/expanded", lambda i: f"/posts/expanded?limit=20&skip={i % 50 * 20}"),
+        Route("GET", "/posts/search", lambda i: f"/posts/search?q=word{i % 200}"),
+        Route("GET", "/posts/{post_id}", lambda i: f"/posts/{post(i)}"),
+        Route("GET", "/posts/by-slug/{slug}", lambda i: f"/posts/by-slug/post-{post(i)}"),
+        Route("GET", "/posts/search/tags", lambda i: f"/posts/search/tags?tag_ids={tag(i)}"),
+        Route("GET", "/posts/search/tags/expanded", lambda i: f"/posts/search/tags/expanded?tag_ids={tag(i)}"),
+        Route("GET", "/posts/search/category", lambda i: f"/posts/search/category?category_ids={category(i)}"),
+        Route("GET", "/posts/search/category/expanded", lambda i: f"/posts/search/category/expanded?category_ids={category(i)}"),
+        Route("PUT", "/posts/{post_id}", lambda i: f"/posts/{post(i)}", auth="admin", body=lambda i: {"content": f"Edited {i}"}),
+        Route("DELETE", "/posts/{post_id}", lambda i: f"/posts/{victim_post(i)}", auth="admin", destructive=True),
+        Route("GET", "/posts/", lambda i: f"/posts/?limit=20&skip={i % 50 * 20}"),
+        Route("PATCH", "/posts/{post_id}/tags", lambda i: f"/posts/{post(i)}/tags", auth="admin", body=lambda i: {"tag_ids": [tag(i), tag(i + 1)]}),
+        Route("PATCH", "/posts/{post_id}/tags/delta", lambda i: f"/posts/{post(i)}/tags/delta", auth="admin", body=lambda i: {"add": [tag(i + 2)], "remove": [tag(i)]}),
+        Route("PATCH", "/posts/tags/bulk", lambda i: "/posts/tags/bulk", auth="admin", body=lambda i: {"items": [{"post_id": post(i * 10 + j), "add": [tag(i)]} for j in range(10)]}),
+        Route("GET", "/posts/{post_id}/comments", lambda i: f"/posts/{post(i)}/comments?replies=3"),
+        Route("POST", "/comments/", lambda i: "/comments/", auth="user", body=lambda i: {"content": f"Bench comment {i}", "post_id": 1 + (comment(i) - 1) % sizes.posts, "author_id": 2, "parent_id": comment(i) if i % 2 else None}),
+        Route("GET", "/comments/{comment_id}/thread", lambda i: f"/comments/{comment(i)}/thread"),
+        Route("GET", "/comments/{comment_id}", lambda i: f"/comments/{comment(i)}"),
+        Route("PUT", "/comments/{comment_id}", lambda i: f"/comments/{comment(i)}", auth="admin", body=lambda i: {"content": f"Edited {i}"}),
+        Route("DELETE", "/comments/{comment_id}", lambda i: f"/comments/{victim_comment(i)}", auth="admin", destructive=True),
+        Route("GET", "/comments/", lambda i: "/comments/"),
+        Route("POST", "/categories/", lambda i: "/categories/", body=lambda i: {"name": f"New category {run}-{i}", "slug": None}),
+        Route("GET", "/categories/{category_id}", lambda i: f"/categories/{category(i)}"),
+        Route("GET", "/categories/by-slug/{slug}", lambda i: f"/categories/by-slug/category-{category(i) - 1}"),
+        Route("PUT", "/categories/{category_id}", lambda i: f"/categories/{category(i)}", auth="admin", body=lambda i: {"slug": f"category-{category(i) - 1}"}),
+        Route("DELETE", "/categories/{category_id}", lambda i: f"/categories/{sizes.categories + 1 + i % sizes.victims}", auth="admin", destructive=True),
+        Route("GET", "/categories/", lambda i: "/categories/"),
+        Route("POST", "/tags/", lambda i: "/tags/", body=lambda i: {"name": f"new-{run}-{i}"}),
+        Route("GET", "/tags/{tag_id}", lambda i: f"/tags/{tag(i)}"),
+        Route("PUT", "/tags/{tag_id}", lambda i: f"/tags/{tag(i)}", auth="admin", body=lambda i: {"name": f"tag{tag(i) - 1}"}),
+        Route("DELETE", "/tags/{tag_id}", lambda i: f"/tags/{sizes.tags + 1 + i % sizes.victims}", auth="admin", destructive=True),
+        Route("GET", "/tags/", lambda i: "/tags/"),
+        Route("GET", "/export/{resource}", lambda i: f"/export/{['posts', 'comments', 'tags'][i % 3]}", auth="admin"),
+    ]
+
+
+'''
+To-Do API
+'''
+
+def seed_todo(db_file: Path, sizes: Sizes):
+    rng = sizes.rng
+    password_hash = CryptContext(schemes=["bcrypt"]).hash(PASSWORD)
+    con = sqlite3.connect(db_file)
+    con.executemany(
+        'INSERT INTO "user" (name, password, role) VALUES (?, ?, ?)',
+        [(name, password_hash, "admin" if name == "admin" else "user")
+         for name in ["admin", "author"] + [f"user{i}" for i in range(sizes.users)] + [f"victim{i}" for i in range(sizes.victims)]],
+    )
+    con.executemany(
+        "INSERT INTO task (name, progress, sprint, start_date) VALUES (?, ?, ?, ?)",
+        [(f"Task {i}", rng.choice(["todo", "in-progress", "done"]), 1 + i % sizes.sprints, timestamp(rng.uniform(0, 365)))
+         for i in range(sizes.tasks + sizes.victims)],
+    )
+    con.commit()
+    con.close()
+
+
+def todo_routes(sizes: Sizes) -> list[Route]:
+    task = lambda i: 1 + i % sizes.tasks
+    user = lambda i: 3 + i % sizes.users
+    run = f"{time.time_ns():x}"
+    task_body = lambda i: {"name": f"Bench task {i}", "progress": "todo", "sprint": 1 + i % sizes.sprints}
+    return [
+        Route("GET", "/protected", lambda i: "/protected", auth="admin"),
+        Route("GET", "/admin_only", lambda i: "/admin_only", auth="admin"),
+        Route("GET", "/db_users", lambda i: "/db_users", auth="admin"),
+        Route("GET", "/user", lambda i: f"/user?id={user(i)}", auth="admin"),
+        Route("POST", "/register", lambda i: "/register", body=lambda i: {"username": f"new-{run}-{i}", "password": PASSWORD}),
+        Route("POST", "/login", lambda i: "/login", form=lambda i: {"username": "author", "password": PASSWORD}),
+        Route("GET", "/admin/metrics", lambda i: "/admin/metrics", auth="admin"),
+        Route("GET", "/me", lambda i: "/me", auth="user"),
+        Route("PUT", "/users/{user_id}", lambda i: f"/users/{user(i)}", auth="admin", body=lambda i: {"role": "user"}),
+        Route("DELETE", "/users/{user_id}", lambda i: f"/users/{sizes.users + 3 + i % sizes.victims}", auth="admin", destructive=True),
+        Route("GET", "/tasks/stats", lambda i: f"/tasks/stats?sprint={1 + i % sizes.sprints}" if i % 2 else "/tasks/stats", auth="user"),
+        Route("GET", "/tasks/{task_id}", lambda i: f"/tasks/{task(i)}", auth="user"),
+        Route("GET", "/tasks", lambda i: f"/tasks?sprint={1 + i % sizes.sprints}" + ("&sort=start_date&descending=true" if i % 2 else "")),
+        Route("POST", "/tasks", lambda i: "/tasks", auth="admin", body=task_body),
+        Route("PUT", "/tasks/{task_id}", lambda i: f"/tasks/{task(i)}", auth="admin", body=lambda i: {**task_body(i), "progress": "done"}),
+        Route("POST", "/tasks/bulk", lambda i: "/tasks/bulk", auth="admin", body=lambda i: [{**task_body(i), "name": f"Bulk {run} {i} {j}"} for j in range(20)]),
+        Route("PATCH", "/tasks/bulk", lambda i: "/tasks/bulk", auth="admin", body=lambda i: {"items": [{"id": task(i * 20 + j), "fields": {"sprint": 1 + (i + 1) % sizes.sprints}} for j in range(20)]}),
+        Route("DELETE", "/tasks/bulk", lambda i: "/tasks/bulk", auth="admin", body=lambda i: {"filter": {"name_prefix": f"Bulk {run} {i} "}}, destructive=True),
+        Route("DELETE", "/tasks/{task_id}", lambda i: f"/tasks/{sizes.tasks + 1 + i % sizes.victims}", auth="admin", destructive=True),
+    ]
+
+
+APPS = {
+    # app -> (seed, routes, module holding the engine, attribute name)
+    "blog": (seed_blog, blog_routes, "database", "engine"),
+    "todo": (seed_todo, todo_routes, "db", "engine"),
+}
+
+
+'''
+Driver
+'''
+
+async def drive_route(http: httpx.AsyncClient, route: Route, concurrency: int, total: int, headers: dict) -> dict:
+    latencies, statuses = [], {}
+    issued = 0
+    timed_queries = [] # from the blog's Server-Timing header, so uvicorn runs get SQL counts too
+
+    async def client():
+        nonlocal issued
+        while issued < total:
+            i = issued
+            issued += 1
+            kwargs = {"headers": route.headers(i) if route.headers else headers.get(route.auth, {})}
+            if route.body is not None:
+                kwargs["json"] = route.body(i)
+            if route.form is not None:
+                kwargs["data"] = route.form(i)
+            start = time.perf_counter()
+            try:
+                response = await http.request(route.method, route.url(i), **kwargs)
+                await response.aread()
+                status = str(response.status_code)
+                match = SERVER_TIMING_QUERIES.search(response.headers.get("server-timing", ""))
+                if match:
+                    timed_queries.append(int(match.group(1)))
+            except httpx.HTTPError as exc:
+                status = type(exc).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    result = {
+        "requests": len(latencies),
+        "status": dict(sorted(statuses.items())),
+        "req_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+    if timed_queries:
+        result["sql_per_request"] = round(sum(timed_queries) / len(timed_queries), 2)
+    return result
+
+
+async def drive_all(http: httpx.AsyncClient, routes: list[Route], args, count_sql=None) -> dict:
+    headers = {
+        "user": {"Authorization": f"Bearer {token('author', 'user', 2)}"},
+        "admin": {"Authorization": f"Bearer {token('admin', 'admin', 1)}"},
+    }
+    results = {}
+    for route in sorted(routes, key=lambda r: r.destructive):
+        before = count_sql() if count_sql else None
+        results[route.name] = await drive_route(http, route, args.concurrency, args.requests, headers)
+        if count_sql and "sql_per_request" not in results[route.name]:
+            results[route.name]["sql_per_request"] = round((count_sql() - before) / args.requests, 2)
+        print(f"{route.name:45} {results[route.name]['req_per_s']:>9} req/s  p99 {results[route.name]['p99_ms']} ms", file=sys.stderr)
+    return results
+
+
+def peak_rss_mb(pid: int | str = "self") -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+# event streams stay open until the client leaves, so a request/response benchmark can't time them;
+# instead each is opened once and must answer 200 (the To-Do stream with a ?token= and no Authorization header, as EventSource sends it)
+STREAMING_ROUTES = {"GET /events"}
+STREAM_CHECKS = {
+    "blog": {"GET /events": lambda: "/events?topics=posts"},
+    "todo": {"GET /events": lambda: f"/events?topics=tasks&token={token('author', 'user', 2)}"},
+}
+
+
+async def stream_status(url: str, http: httpx.AsyncClient = None, app=None) -> int:
+    # the status a stream opens with; only its response start is awaited, then the stream is dropped
+    if app is None:
+        async with http.stream("GET", url) as response:
+            return response.status_code
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query.encode(),
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    started = asyncio.get_running_loop().create_future()
+    disconnect = asyncio.Event()
+
+    async def receive():
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start" and not started.done():
+            started.set_result(message["status"])
+
+    task = asyncio.create_task(app(scope, receive, send))
+    try:
+        return await asyncio.wait_for(started, 10)
+    finally:
+        disconnect.set()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def check_streams(app_name: str, http: httpx.AsyncClient = None, app=None) -> dict:
+    return {name: await stream_status(url(), http, app) for name, url in STREAM_CHECKS[app_name].items()}
+
+
+def declared_routes(app_dir: Path) -> set[str]:
+    # "METHOD /path" for every route decorator in main.py, to report what the harness does not cover
+    source = (app_dir / "main.py").read_text()
+    pattern = re.compile(r"@app\.(get|post|put|patch|delete)\(\s*[\"']([^\"']+)[\"']")
+    return {f"{method.upper()} {path}" for method, path in pattern.findall(source)} - STREAMING_ROUTES
+
+
+def run_asgi(app_name: str, app_dir: Path, workdir: Path, routes: list[Route], sizes: Sizes, args) -> dict:
+    seed_fn, _, engine_module, engine_attr = APPS[app_name]
+    os.chdir(workdir)
+    sys.path.insert(0, str(app_dir))
+    import main
+    from sqlalchemy import event
+
+    statements = 0
+
+    def count(*_):
+        nonlocal statements
+        statements += 1
+
+    async def run():
+        async with main.app.router.lifespan_context(main.app):
+            engine = getattr(sys.modules[engine_module], engine_attr)
+            event.listen(engine.sync_engine, "before_cursor_execute", count)
+            seed_fn(workdir / "test.db", sizes)
+            transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False) # count a crashing route as 500s, like uvicorn would
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+                return await drive_all(http, routes, args, count_sql=lambda: statements), await check_streams(app_name, app=main.app)
+
+    results, streams = asyncio.run(run())
+    return {"routes": results, "streams": streams, "peak_rss_mb": peak_rss_mb()}
+
+
+def run_uvicorn(app_name: str, app_dir: Path, workdir: Path, routes: list[Route], sizes: Sizes, args, env: dict) -> dict:
+    seed_fn = APPS[app_name][0]
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(app_dir), "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env={**os.environ, **env}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(base_url) if app_name == "blog" else wait_until_listening(base_url)
+        seed_fn(workdir / "test.db", sizes)
+
+        async def run():
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as http:
+                return await drive_all(http, routes, args), await check_streams(app_name, http=http)
+
+        results, streams = asyncio.run(run())
+        return {"routes": results, "streams": streams, "peak_rss_mb": peak_rss_mb(server.pid)}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def wait_until_listening(base_url: str, timeout: float = 30.0):
+    # the To-Do API has no "/" route; any HTTP answer means it is up
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(base_url + "/docs")
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not start")
+
+
+def compare(current: dict, baseline: dict):
+    print(f"{'route':45} {'req/s':>18} {'p99 ms':>20} {'sql/req':>12}")
+    for name, now in current["routes"].items():
+        before = baseline["routes"].get(name)
+        if before is None:
+            continue
+        sql = f"{before.get('sql_per_request', '-')} -> {now.get('sql_per_request', '-')}"
+        print(f"{name:45} {before['req_per_s']:>8} -> {now['req_per_s']:<8} {before['p99_ms']:>9} -> {now['p99_ms']:<9} {sql:>12}")
+
+
+def git_commit(path: Path) -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=path, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=APPS, default="blog")
+    parser.add_argument("--app-dir", type=Path, help="another checkout of the app directory to benchmark")
+    parser.add_argument("--mode", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--routes", help="only run routes whose 'METHOD /path' matches this regex")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--posts", type=int, default=Sizes.posts)
+    parser.add_argument("--tasks", type=int, default=Sizes.tasks)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra environment for the app")
+    parser.add_argument("--output", type=Path, help="write the JSON result here as well as to stdout")
+    parser.add_argument("--compare", type=Path, help="a previous --output file to print deltas against")
+    args = parser.parse_args()
+
+    app_dir = (args.app_dir or APP_DIRS[args.app]).resolve()
+    sizes = Sizes(posts=args.posts, tasks=args.tasks, victims=max(Sizes.victims, args.requests))
+    routes = APPS[args.app][1](sizes)
+    if args.routes:
+        routes = [route for route in routes if re.search(args.routes, route.name)]
+
+    overrides = dict(item.split("=", 1) for item in args.env)
+    # the hashing pool answers 429 past PASSWORD_HASH_MAX_PENDING jobs (4 per CPU by default); let every client queue
+    # so /login and sign-up measure hashing throughput rather than rejections
+    env = {**ENV, "PASSWORD_HASH_MODE": "thread", "PASSWORD_HASH_MAX_PENDING": str(max(args.concurrency, 1)), **overrides}
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        env["DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir / 'test.db'}"
+        if args.mode == "asgi":
+            os.environ.update(env)
+            result = run_asgi(args.app, app_dir, workdir, routes, sizes, args)
+        else:
+            result = run_uvicorn(args.app, app_dir, workdir, routes, sizes, args, env)
+
+    result = {
+        "meta": {
+            "app": args.app,
+            "app_dir": str(app_dir),
+            "commit": git_commit(app_dir),
+            "mode": args.mode,
+            "workers": args.workers if args.mode == "uvicorn" else None,
+            "concurrency": args.concurrency,
+            "requests_per_route": args.requests,
+            "sizes": {k: v for k, v in vars(sizes).items() if k != "rng"},
+            "env": {k: v for k, v in env.items() if k not in ENV and k != "DATABASE_URL"},
+            "python": platform.python_version(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        },
+        "uncovered_routes": sorted(declared_routes(app_dir) - {route.name for route in APPS[args.app][1](sizes)}),
+        **result,
+    }
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        args.output.write_text(text)
+    if args.compare:
+        compare(result, json.loads(args.compare.read_text()))
+    failed = {name: status for name, status in result["streams"].items() if status != 200}
+    if failed:
+        sys.exit(f"event streams failed to open: {failed}")
+    # 429s mean a route timed the limiter instead of the API, unless --env asked for the limits
+    rejected = {name: route["status"]["429"] for name, route in result["routes"].items() if "429" in route["status"]}
+    if rejected and not overrides.keys() & {"RATE_LIMIT_RATE", "PASSWORD_HASH_MAX_PENDING"}:
+        sys.exit(f"requests were rejected with 429, so these routes measured load shedding: {rejected}")
+
+
+if __name__ == "__main__":
+    main()
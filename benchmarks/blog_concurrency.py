@@ -0,0 +1,145 @@
+"""Throughput of the blog API's public read routes under many concurrent clients.
+
+Starts uvicorn against a throwaway SQLite database, seeds it, and drives it
+with --concurrency simultaneous HTTP clients. Point --app-dir at another
+checkout (e.g. a `git worktree` of an older commit) to compare before/after:
+
+    python benchmarks/blog_concurrency.py --concurrency 100
+    python benchmarks/blog_concurrency.py --concurrency 100 --app-dir /tmp/old/blog_api/app
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+BLOG_APP = ROOT / "blog_api" / "app"
+
+ENV = {
+    "SECRET_KEY": "benchmark-secret",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+    "RATE_LIMIT_RATE": "0", # measure the API, not the rate limiter; pass --env RATE_LIMIT_RATE=... to include it
+}
+
+
+def start_server(app_dir: Path, workdir: Path, port: int, extra_env: dict | None = None) -> subprocess.Popen:
+    env = {**os.environ, **ENV, **(extra_env or {})}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(app_dir),
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_up(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url + "/").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not start")
+
+
+def seed(db_file: Path, posts: int, comments_per_post: int = 2):
+    now = datetime.utcnow().isoformat(sep=" ")
+    con = sqlite3.connect(db_file)
+    con.execute("INSERT INTO users (username, email, password_hash, created_at, is_admin) VALUES ('bench', 'bench@example.com', 'x', ?, 0)", (now,))
+    con.execute("INSERT INTO categories (name, slug) VALUES ('bench', 'bench-1')")
+    con.executemany(
+        "INSERT INTO posts (title, slug, content, status, publication_date, updated_at, author_id, category_id) VALUES (?, ?, ?, 'published', ?, ?, 1, 1)",
+        ((f"Post {i}", f"post-{i}", f"Benchmark content {i}", now, now) for i in range(1, posts + 1)),
+    )
+    con.executemany(
+        "INSERT INTO comments (content, created_at, updated_at, author_id, post_id) VALUES (?, ?, ?, 1, ?)",
+        ((f"Comment {i}", now, now, i % posts + 1) for i in range(posts * comments_per_post)),
+    )
+    con.execute("UPDATE comments SET path = printf('%010d/', id) WHERE path IS NULL") # top-level, see models.comment_path
+    con.commit()
+    con.close()
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def drive(base_url: str, paths: list[str], concurrency: int, total: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    issued = 0
+
+    async def client(http: httpx.AsyncClient):
+        nonlocal errors, issued
+        while issued < total:
+            path = paths[issued % len(paths)]
+            issued += 1
+            start = time.perf_counter()
+            try:
+                response = await http.get(path)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "req_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", type=Path, default=BLOG_APP)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    paths = ["/posts/?limit=20", "/posts/{id}", "/posts/{id}/comments", "/categories/"]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(args.app_dir, Path(workdir), args.port)
+        try:
+            wait_until_up(base_url)
+            seed(Path(workdir) / "test.db", args.posts)
+            expanded = [p.replace("{id}", str(i % args.posts + 1)) for i, p in enumerate(paths * 25)]
+            result = asyncio.run(drive(base_url, expanded, args.concurrency, args.requests))
+        finally:
+            server.terminate()
+            server.wait()
+
+    result.update({"app_dir": str(args.app_dir), "concurrency": args.concurrency})
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
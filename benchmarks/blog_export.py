@@ -0,0 +1,97 @@
+"""Resident memory while streaming a large comments table through /export.
+
+Seeds --rows comments into a temporary SQLite database, then drains the
+same generator GET /export/comments streams from, sampling RSS as it goes.
+With --materialize it also loads the table the way GET /comments/ does
+(`.scalars().all()`) for comparison:
+
+    python benchmarks/blog_export.py --rows 5000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "blog_api" / "app"))
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def seed(db_file: Path, rows: int):
+    from sqlalchemy import create_engine
+    from models import Base
+
+    Base.metadata.create_all(create_engine(f"sqlite:///{db_file}"))
+    con = sqlite3.connect(db_file)
+    batch = 50000
+    for start in range(0, rows, batch):
+        con.executemany(
+            "INSERT INTO comments (content, created_at, updated_at, author_id, post_id) "
+            "VALUES (?, '2024-01-01 00:00:00', '2024-01-01 00:00:00', 1, ?)",
+            ((f"Comment number {i} with a little text", i % 1000 + 1) for i in range(start, min(rows, start + batch))),
+        )
+    con.commit()
+    con.close()
+
+
+async def stream(rows: int, samples: int) -> dict:
+    from main import export_body
+    from crud import export_query
+    from schemas import CommentResponse, ExportFormat, ExportResource
+
+    checkpoints = {max(1, rows * i // samples) for i in range(1, samples + 1)}
+    seen, written, trace = 0, 0, []
+    started = time.perf_counter()
+    async for chunk in export_body(export_query(ExportResource.comments), CommentResponse, ExportFormat.ndjson):
+        written += len(chunk)
+        before, seen = seen, seen + chunk.count("\n")
+        if any(before < point <= seen for point in checkpoints):
+            trace.append({"rows": seen, "rss_mb": round(rss_mb(), 1)})
+    return {"rows": seen, "bytes": written, "seconds": round(time.perf_counter() - started, 2), "rss_trace": trace}
+
+
+async def materialize() -> dict:
+    from crud import get_comments
+    from database import SessionLocal
+
+    started = time.perf_counter()
+    async with SessionLocal() as db:
+        comments = await get_comments(db)
+        return {"rows": len(comments), "seconds": round(time.perf_counter() - started, 2), "rss_mb": round(rss_mb(), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--materialize", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_file = Path(workdir) / "export.db"
+        os.environ.update({
+            "DATABASE_URL": f"sqlite+aiosqlite:///{db_file}",
+            "SECRET_KEY": "benchmark-secret", "ALGORITHM": "HS256", "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+        })
+        seed(db_file, args.rows)
+
+        result = {"baseline_rss_mb": round(rss_mb(), 1), "stream": asyncio.run(stream(args.rows, args.samples))}
+        if args.materialize:
+            result["materialize"] = asyncio.run(materialize())
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""FTS5 post search versus a LIKE '%q%' scan on a synthetic corpus.
+
+Builds the blog schema (including the posts_fts index and triggers from
+models.py) in a temporary SQLite file, fills it with --posts random posts
+and times the query shape used by crud.search_posts against the LIKE
+filter a client-side search would need:
+
+    python benchmarks/blog_search.py --posts 1000000
+"""
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "blog_api" / "app"))
+
+from models import Base, POSTS_FTS_DDL  # noqa: E402
+
+FTS_QUERY = """
+SELECT posts.id, hits.rank, hits.snippet FROM posts JOIN (
+    SELECT rowid AS post_id, bm25(posts_fts, 4.0, 1.0) AS rank,
+           snippet(posts_fts, -1, '<mark>', '</mark>', '…', 24) AS snippet
+    FROM posts_fts WHERE posts_fts MATCH ?
+) AS hits ON hits.post_id = posts.id
+ORDER BY hits.rank, posts.id LIMIT ?
+"""
+LIKE_QUERY = "SELECT id FROM posts WHERE title LIKE ? OR content LIKE ? ORDER BY id LIMIT ?"
+# Ranking or counting LIKE matches has to visit every row; this is the cost a real ordering would pay
+LIKE_ALL_QUERY = "SELECT count(*) FROM posts WHERE title LIKE ? OR content LIKE ?"
+
+
+def build_corpus(db_file: Path, posts: int, seed: int = 7):
+    Base.metadata.create_all(create_engine(f"sqlite:///{db_file}"))
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(20000)]
+    # Zipf-like weights so a few terms are common and most are rare
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    con = sqlite3.connect(db_file)
+    batch = 10000
+    for start in range(0, posts, batch):
+        rows = []
+        for i in range(start, min(posts, start + batch)):
+            title = " ".join(rng.choices(vocabulary, weights, k=6))
+            content = " ".join(rng.choices(vocabulary, weights, k=60))
+            rows.append((title, f"post-{i}", content))
+        con.executemany(
+            "INSERT INTO posts (title, slug, content, status, publication_date, author_id, category_id) "
+            "VALUES (?, ?, ?, 'published', '2024-01-01 00:00:00', 1, 1)", rows)
+    # index after loading, as database.create_search_index does for existing data
+    for statement in POSTS_FTS_DDL:
+        con.execute(statement)
+    con.execute("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')")
+    con.commit()
+    return con
+
+
+def time_query(con: sqlite3.Connection, sql: str, params: tuple, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = con.execute(sql, params).fetchall()
+        samples.append(time.perf_counter() - started)
+    return {"rows": len(rows), "median_ms": round(statistics.median(samples) * 1000, 3), "max_ms": round(max(samples) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    terms = {"common": "word1", "medium": "word500", "rare": "word19000"}
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        con = build_corpus(Path(workdir) / "search.db", args.posts)
+        results = {"posts": args.posts, "build_seconds": round(time.perf_counter() - started, 1), "queries": {}}
+        for label, term in terms.items():
+            results["queries"][label] = {
+                "term": term,
+                "fts5": time_query(con, FTS_QUERY, (f'"{term}"', args.limit), args.repeat),
+                "like": time_query(con, LIKE_QUERY, (f"%{term}%", f"%{term}%", args.limit), args.repeat),
+                "like_full_scan": time_query(con, LIKE_ALL_QUERY, (f"%{term}%", f"%{term}%"), args.repeat),
+            }
+        con.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compare the blog's response serializers on its list endpoints.
+
+Seeds a throwaway database (the same data as api_bench.py) and, for each
+list endpoint's crud call, times three ways of turning the result into the
+JSON body:
+
+    orm        ORM objects validated through the response_model and dumped,
+               which is what FastAPI does by default
+    rows       only the response columns selected, rows validated through
+               the same from_attributes model and dumped
+    fast       only the response columns selected, rows encoded directly
+               (FAST_JSON=1: orjson if installed, else pydantic_core)
+
+Every variant's body is checked to decode to the same JSON as "orm".
+
+    python benchmarks/blog_serializers.py
+    python benchmarks/blog_serializers.py --posts 20000 --repeat 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from api_bench import APP_DIRS, Sizes, seed_blog
+from blog_concurrency import ENV
+
+
+def cases():
+    import crud
+    from schemas import CategoryResponse, CommentResponse, PostResponse, TagResponse, UserResponse
+
+    # (endpoint, response schema, crud call taking an optional schema)
+    return [
+        ("GET /posts/?limit=100", PostResponse, lambda db, schema: crud.get_posts(db, limit=100, schema=schema)),
+        ("GET /posts/?limit=1000", PostResponse, lambda db, schema: crud.get_posts(db, limit=1000, schema=schema)),
+        ("GET /posts/search/tags", PostResponse, lambda db, schema: crud.search_tag_posts(db, [1, 2], schema=schema)),
+        ("GET /posts/search/category", PostResponse, lambda db, schema: crud.search_category_posts(db, [1], schema=schema)),
+        ("GET /comments/", CommentResponse, lambda db, schema: crud.get_comments(db, schema=schema)),
+        ("GET /users/", UserResponse, lambda db, schema: crud.get_users(db, schema=schema)),
+        ("GET /categories/", CategoryResponse, lambda db, schema: crud.get_categories(db, schema=schema)),
+        ("GET /tags/", TagResponse, lambda db, schema: crud.get_tags(db, schema=schema)),
+    ]
+
+
+async def measure(repeat: int) -> dict:
+    from database import SessionLocal, engine
+    from pydantic import TypeAdapter
+    from serializers import encode_rows
+
+    results = {}
+    for endpoint, schema, call in cases():
+        adapter = TypeAdapter(list[schema])
+        variants = {
+            "orm": (None, lambda items: adapter.dump_json(adapter.validate_python(items, from_attributes=True))),
+            "rows": (schema, lambda items: adapter.dump_json(adapter.validate_python(items, from_attributes=True))),
+            "fast": (schema, encode_rows),
+        }
+        timings, bodies = {}, {}
+        for name, (selected, serialize) in variants.items():
+            fetch, encode = [], []
+            for _ in range(repeat):
+                # a fresh session per call, like a request, so ORM objects are really built each time
+                async with SessionLocal() as db:
+                    started = time.perf_counter()
+                    items = await call(db, selected)
+                    fetched = time.perf_counter()
+                    bodies[name] = serialize(items)
+                    fetch.append(fetched - started)
+                    encode.append(time.perf_counter() - fetched)
+            timings[name] = {
+                "fetch_ms": round(statistics.median(fetch) * 1000, 3),
+                "serialize_ms": round(statistics.median(encode) * 1000, 3),
+                "total_ms": round((statistics.median(fetch) + statistics.median(encode)) * 1000, 3),
+            }
+        expected = json.loads(bodies["orm"])
+        for name, body in bodies.items():
+            if json.loads(body) != expected:
+                raise SystemExit(f"{endpoint}: '{name}' body differs from the response_model output")
+        results[endpoint] = {
+            "items": len(expected),
+            **timings,
+            "speedup": round(timings["orm"]["total_ms"] / timings["fast"]["total_ms"], 2),
+        }
+    await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_file = Path(workdir) / "serializers.db"
+        os.environ.update({**ENV, "DATABASE_URL": f"sqlite+aiosqlite:///{db_file}", "RESPONSE_CACHE_TTL": "0"})
+        sys.path.insert(0, str(APP_DIRS["blog"]))
+        from database import create_tables
+        from serializers import orjson
+
+        async def run():
+            await create_tables()
+            seed_blog(db_file, Sizes(posts=args.posts, victims=0))
+            return await measure(args.repeat)
+        results = asyncio.run(run())
+        encoder = "orjson" if orjson is not None else "pydantic_core"
+
+    print(json.dumps({"posts": args.posts, "repeat": args.repeat, "fast_encoder": encoder, "endpoints": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Mixed read/write throughput of the blog API under each SQLite engine profile.
+
+For every DB_PROFILE (see blog_api/app/database.py) this starts uvicorn on a
+fresh database, seeds it, and runs --concurrency clients that mostly read
+posts and comments and, with probability --write-ratio, create a comment or
+edit a post. The response cache is disabled so every request reaches SQLite:
+
+    python benchmarks/db_profiles.py --concurrency 50 --write-ratio 0.2
+    python benchmarks/db_profiles.py --profiles rollback wal
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+from jose import jwt
+
+from blog_concurrency import BLOG_APP, ENV, percentile, seed, start_server, wait_until_up
+
+
+def bench_token() -> str:
+    # the seeded "bench" user has no usable password; sign its token directly instead of calling /login
+    claims = {"sub": "bench", "role": "user", "exp": datetime.utcnow() + timedelta(hours=1)}
+    return jwt.encode(claims, ENV["SECRET_KEY"], algorithm=ENV["ALGORITHM"])
+
+
+async def drive_mixed(base_url: str, posts: int, concurrency: int, total: int, write_ratio: float, seed_value: int = 7) -> dict:
+    rng = random.Random(seed_value)
+    latencies = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    issued = 0
+    headers = {"Authorization": f"Bearer {bench_token()}"}
+
+    async def request(http: httpx.AsyncClient):
+        post_id = rng.randint(1, posts)
+        if rng.random() < write_ratio:
+            if rng.random() < 0.5:
+                return "write", http.post("/comments/", json={"content": "load test", "post_id": post_id, "author_id": 1}, headers=headers)
+            return "write", http.put(f"/posts/{post_id}", json={"content": f"edited {time.time()}"}, headers=headers)
+        path = rng.choice([f"/posts/{post_id}", f"/posts/{post_id}/comments", "/posts/?limit=20"])
+        return "read", http.get(path)
+
+    async def client(http: httpx.AsyncClient):
+        nonlocal issued
+        while issued < total:
+            issued += 1
+            kind, pending = await request(http)
+            start = time.perf_counter()
+            try:
+                response = await pending
+                if response.status_code >= 400:
+                    errors[kind] += 1
+            except httpx.HTTPError:
+                errors[kind] += 1
+            latencies[kind].append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    result = {"seconds": round(elapsed, 3), "req_per_s": round(sum(map(len, latencies.values())) / elapsed, 1)}
+    for kind, samples in latencies.items():
+        if samples:
+            result[kind] = {
+                "requests": len(samples),
+                "errors": errors[kind],
+                "p50_ms": round(statistics.median(samples) * 1000, 2),
+                "p95_ms": round(percentile(samples, 95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", type=Path, default=BLOG_APP)
+    parser.add_argument("--profiles", nargs="+", default=["rollback", "wal", "durable"])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = {}
+    for profile in args.profiles:
+        with tempfile.TemporaryDirectory() as workdir:
+            server = start_server(args.app_dir, Path(workdir), args.port, {"DB_PROFILE": profile, "RESPONSE_CACHE_TTL": "0"})
+            try:
+                wait_until_up(base_url)
+                seed(Path(workdir) / "test.db", args.posts)
+                results[profile] = asyncio.run(drive_mixed(base_url, args.posts, args.concurrency, args.requests, args.write_ratio))
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(json.dumps({"concurrency": args.concurrency, "write_ratio": args.write_ratio, "profiles": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""EXPLAIN QUERY PLAN regression check for the blog's hot crud.py queries.
+
+Builds the schema in a temporary SQLite file, seeds a few rows, runs each
+crud function below while recording the SELECTs it issues, and explains
+every one of them. Exits non-zero if any query scans a whole table other
+than the ones its case allows, so it can gate CI:
+
+    python benchmarks/query_plans.py
+    python benchmarks/query_plans.py --verbose   # print every plan
+"""
+import argparse
+import asyncio
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "blog_api" / "app"))
+
+# "SCAN posts" / "SCAN posts USING INDEX ix" walk every row; "SEARCH ..." and virtual tables do not
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?!.*VIRTUAL TABLE)")
+
+
+def seed(db_file: Path):
+    con = sqlite3.connect(db_file)
+    con.execute("INSERT INTO users (username, email, password_hash, created_at, is_admin) VALUES ('plan', 'plan@example.com', 'x', '2024-01-01', 0)")
+    con.execute("INSERT INTO categories (name, slug) VALUES ('plan', 'plan-1')")
+    con.executemany("INSERT INTO tags (name) VALUES (?)", [("a",), ("b",)])
+    con.executemany(
+        "INSERT INTO posts (title, slug, content, status, publication_date, author_id, category_id) VALUES (?, ?, 'text', 'published', ?, 1, 1)",
+        [(f"Post {i}", f"post-{i}", f"2024-01-0{i} 00:00:00.000000") for i in range(1, 6)],
+    )
+    con.executemany("INSERT INTO tag_post_association (post_id, tag_id) VALUES (?, ?)", [(1, 1), (1, 2), (2, 1)])
+    con.executemany(
+        "INSERT INTO comments (content, created_at, author_id, post_id, parent_id, path, depth) VALUES ('c', '2024-01-01', 1, ?, ?, ?, ?)",
+        [(1, None, "0000000001/", 0), (1, 1, "0000000001/0000000002/", 1), (2, None, "0000000003/", 0)],
+    )
+    con.commit()
+    con.close()
+
+
+def cases():
+    import crud
+    from pagination import encode_cursor
+    from datetime import datetime
+    from schemas import PostStatus, PostTagsDelta
+
+    cursor = encode_cursor(datetime(2024, 1, 1), 2)
+    # (name, coroutine factory, tables a full scan is acceptable for)
+    return [
+        ("get_posts offset page", lambda db: crud.get_posts(db, limit=10), {"posts"}), # ordered index walk stopped by LIMIT
+        ("get_posts cursor page", lambda db: crud.get_posts(db, limit=10, cursor=cursor), set()),
+        ("get_posts by status", lambda db: crud.get_posts(db, limit=10, status=PostStatus.published), set()),
+        ("get_posts by status + cursor", lambda db: crud.get_posts(db, limit=10, status=PostStatus.published, cursor=cursor), set()),
+        ("get_posts expanded", lambda db: crud.get_posts(db, limit=10, cursor=cursor, expanded=True), set()),
+        ("get_post", lambda db: crud.get_post(db, 1), set()),
+        ("get_post_by_slug", lambda db: crud.get_post_by_slug(db, "post-1"), set()), # slug index is cold here
+        ("get_category_by_slug", lambda db: crud.get_category_by_slug(db, "plan-1"), set()),
+        ("get_post_comments", lambda db: crud.get_post_comments(db, 1), set()),
+        ("get_post_comments replies", lambda db: crud.get_post_comments(db, 1, cursor=encode_cursor(0), replies=3), set()),
+        ("get_post_comments level", lambda db: crud.get_post_comments(db, 1, parent_id=1, replies=3), set()),
+        ("get_comment_thread", lambda db: crud.get_comment_thread(db, 1, max_depth=2), set()),
+        ("delete_comment subtree", lambda db: crud.delete_comment(db, 2), set()),
+        ("get_post_author", lambda db: crud.get_post_author(db, 1), set()),
+        ("search_tag_posts", lambda db: crud.search_tag_posts(db, [1, 2]), set()),
+        ("search_tag_posts expanded", lambda db: crud.search_tag_posts(db, [1], expanded=True), set()),
+        ("search_category_posts", lambda db: crud.search_category_posts(db, [1]), set()),
+        ("search_posts", lambda db: crud.search_posts(db, "post"), set()),
+        ("get_post_authors", lambda db: crud.get_post_authors(db, [1, 2]), set()),
+        ("change_post_tags", lambda db: crud.change_post_tags(db, 1, PostTagsDelta(add=[2], remove=[1])), set()),
+        ("get_user", lambda db: crud.get_user(db, "plan"), set()),
+        ("get_comment", lambda db: crud.get_comment(db, 1), set()),
+        ("get_category", lambda db: crud.get_category(db, 1), set()),
+        ("get_tag", lambda db: crud.get_tag(db, 1), set()),
+    ]
+
+
+async def capture_all() -> list[tuple[str, set, list[tuple[str, tuple]]]]:
+    from database import SessionLocal, create_tables, engine
+    from sqlalchemy import event
+
+    await create_tables()
+    seed(Path(engine.url.database))
+    captured = []
+    for name, factory, allowed in cases():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith(("SELECT", "WITH")) and not executemany:
+                statements.append((statement, tuple(parameters or ())))
+
+        event.listen(engine.sync_engine, "before_cursor_execute", record)
+        try:
+            async with SessionLocal() as db:
+                await factory(db)
+                await db.rollback()
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", record)
+        captured.append((name, allowed, statements))
+    await engine.dispose()
+    return captured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_file = Path(workdir) / "plans.db"
+        os.environ.update({
+            "DATABASE_URL": f"sqlite+aiosqlite:///{db_file}",
+            "SECRET_KEY": "plan-secret", "ALGORITHM": "HS256", "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+        })
+        captured = asyncio.run(capture_all())
+
+        con = sqlite3.connect(db_file)
+        failures = 0
+        for name, allowed, statements in captured:
+            for statement, parameters in statements:
+                plan = [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+                # subqueries SQLite evaluates into a temporary result are scanned by name too; those are not tables
+                derived = {line.split()[-1] for line in plan if line.startswith(("CO-ROUTINE", "MATERIALIZE"))}
+                scans = {m.group(1) for m in map(FULL_SCAN.match, plan) if m} - allowed - derived
+                status = "FAIL" if scans else "ok"
+                failures += bool(scans)
+                print(f"{status:4} {name}" + (f": full scan of {', '.join(sorted(scans))}" if scans else ""))
+                if scans or args.verbose:
+                    print("     " + " ".join(statement.split()))
+                    for line in plan:
+                        print(f"       {line}")
+        con.close()
+
+    print(f"{failures} query plan regression(s)" if failures else "all query plans use indexes")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,23 @@
 # auth.py
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from dotenv import load_dotenv
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi import FastAPI, Query, Security, Depends, HTTPException
 from crud import get_user # Keep this import, as get_current_user needs it
-from database import get_db
-from sqlalchemy.orm import Session
-from models import User
+from database import get_db, SessionLocal
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import User, RevokedToken
 from security import verify_password # Import from the new security file
+from cache import token_cache, user_cache, revocations
 
 
+import asyncio
+import logging
 import os
+import time
+import uuid
 
 load_dotenv()
 
@@ -22,32 +28,111 @@ env_vars = {
     "ACCESS_TOKEN_EXPIRE_MINUTES": int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 }
 
+# "session": every request loads the caller's User row (cached for AUTH_CACHE_TTL).
+# "stateless": the verified claims (uid, sub, role) are the caller, authenticating costs one HMAC check.
+AUTH_MODE = os.getenv("AUTH_MODE", "session")
+if AUTH_MODE not in ("session", "stateless"):
+    raise RuntimeError(f"Unknown AUTH_MODE '{AUTH_MODE}', expected 'session' or 'stateless'")
+# seconds between reloads of revocations written by other workers
+AUTH_REVOCATION_SYNC = float(os.getenv("AUTH_REVOCATION_SYNC", 5))
+
+logger = logging.getLogger("blog_api.auth")
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.utcnow() +  (expires_delta or timedelta(minutes= env_vars['ACCESS_TOKEN_EXPIRE_MINUTES']))
-    to_encode.update({"exp": expire})
+    # jti names the token for logout, a sub-second iat orders it against user-wide revocations
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex})
     return jwt.encode(to_encode, env_vars['SECRET_KEY'], algorithm=env_vars['ALGORITHM'])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def get_current_user(
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, env_vars['SECRET_KEY'], algorithms=[env_vars['ALGORITHM']])
+        # never keep a token around longer than it is valid
+        token_cache.set(token, payload, ttl=payload.get("exp", 0) - time.time())
+    return payload
+
+class TokenUser:
+    """The caller as described by a verified token: enough for role and ownership checks, without a User row."""
+
+    __slots__ = ("id", "username", "is_admin")
+
+    def __init__(self, id: int, username: str, is_admin: bool):
+        self.id = id
+        self.username = username
+        self.is_admin = is_admin
+
+async def get_token_claims(
     token: str = Depends(oauth2_scheme),
     token_q: str = Query(None, alias="token"),
-    db: Session = Depends(get_db)
-):
+) -> dict:
     token = token_q or token
     try:
-        payload = jwt.decode(token, env_vars['SECRET_KEY'], algorithms=[env_vars['ALGORITHM']])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        user = get_user(db, username) 
-        return user
+        payload = decode_token(token)
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if payload.get("sub") is None or revocations.is_revoked(payload):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    return payload
 
-def require_admin(current_user: User = Depends(get_current_user)):
+async def get_current_user_record(claims: dict = Depends(get_token_claims), db: AsyncSession = Depends(get_db)) -> User:
+    # the caller's User row whatever AUTH_MODE is, for endpoints that return or change it
+    username = claims["sub"]
+    user = user_cache.get(username)
+    if user is None:
+        user = await get_user(db, username)
+        user_cache.set(username, user)
+    return user
+
+async def get_stateless_user(claims: dict = Depends(get_token_claims)) -> TokenUser:
+    if "uid" not in claims:
+        # issued before tokens carried the user id
+        raise HTTPException(status_code=401, detail="Token expired, log in again")
+    return TokenUser(claims["uid"], claims["sub"], claims.get("role") == "admin")
+
+# routes bind their dependency when they are declared, so pick the implementation once
+get_current_user = get_stateless_user if AUTH_MODE == "stateless" else get_current_user_record
+
+async def require_admin(current_user: User = Depends(get_current_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admins only")
-    return current_user
\ No newline at end of file
+    return current_user
+
+'''
+Revocation sync
+'''
+
+async def sync_revocations(db: AsyncSession):
+    # revoked_tokens only grows by appends, so loading rows past the last seen id picks up other workers' revocations
+    now = datetime.utcnow()
+    rows = (await db.execute(select(RevokedToken).where(RevokedToken.id > revocations.last_id).order_by(RevokedToken.id))).scalars().all()
+    for row in rows:
+        if row.expires_at > now:
+            revocations.add(row.jti, row.user_id, _epoch(row.revoked_at), _epoch(row.expires_at))
+        revocations.last_id = row.id
+    revocations.prune()
+
+async def prune_revocations(db: AsyncSession):
+    # keep the newest row even when expired: SQLite hands out max(id) + 1, and reused ids would hide rows from the sync
+    newest = select(func.max(RevokedToken.id)).scalar_subquery()
+    await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= datetime.utcnow(), RevokedToken.id < newest))
+    await db.commit()
+
+async def revocation_sync_loop():
+    last_prune = time.monotonic()
+    while True:
+        await asyncio.sleep(AUTH_REVOCATION_SYNC)
+        try:
+            async with SessionLocal() as db:
+                await sync_revocations(db)
+                if time.monotonic() - last_prune >= 3600:
+                    await prune_revocations(db)
+                    last_prune = time.monotonic()
+        except Exception:
+            logger.exception("revocation sync failed")
+
+def _epoch(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+from serializers import encode_rows
+
+try:
+    import redis.asyncio as redis
+except ImportError: # optional shared backend
+    redis = None
+
+class TTLCache:
+    """Bounded LRU mapping whose entries also expire after a time-to-live."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+                if self.on_evict:
+                    self.on_evict(key, entry[1])
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted_key, (_, evicted) = self._data.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(evicted_key, evicted)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def discard_if(self, predicate):
+        for key in [k for k, (_, value) in self._data.items() if predicate(value)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+'''
+Authentication caches
+'''
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+
+# raw JWT -> decoded claims, and username -> User row (detached once its session closes)
+token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+user_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+def invalidate_user(*usernames: str):
+    for username in usernames:
+        user_cache.pop(username)
+
+ACCESS_TOKEN_LIFETIME = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30)) * 60
+
+class TokenRevocations:
+    """Tokens that must be refused before they expire: single tokens by jti (logout), or every token
+    of a user issued up to some time (password, role or username change). Mirrors the revoked_tokens table."""
+
+    def __init__(self):
+        self.jtis = {}    # jti -> exp (epoch seconds)
+        self.users = {}   # user id -> (revoked at, exp of the last token it covers)
+        self.last_id = 0  # highest revoked_tokens row already loaded
+
+    def add(self, jti: str | None, user_id: int | None, revoked_at: float, expires_at: float):
+        if jti:
+            self.jtis[jti] = max(expires_at, self.jtis.get(jti, 0))
+        if user_id is not None:
+            previous = self.users.get(user_id)
+            if previous is None or revoked_at > previous[0]:
+                self.users[user_id] = (revoked_at, max(expires_at, previous[1] if previous else 0))
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self.jtis:
+            return True
+        revoked = self.users.get(claims.get("uid"))
+        return revoked is not None and claims.get("iat", 0) <= revoked[0]
+
+    def prune(self, now: float | None = None):
+        # an entry outlives its use once every token it covers has expired on its own
+        now = time.time() if now is None else now
+        self.jtis = {jti: exp for jti, exp in self.jtis.items() if exp > now}
+        self.users = {uid: entry for uid, entry in self.users.items() if entry[1] > now}
+
+    def stats(self) -> dict:
+        return {"tokens": len(self.jtis), "users": len(self.users), "last_id": self.last_id}
+
+revocations = TokenRevocations()
+
+'''
+Slug index
+'''
+
+SLUG_CACHE_SIZE = int(os.getenv("SLUG_CACHE_SIZE", 50000))
+
+# slug -> id per table. Entries are only hints: whoever uses one checks the fetched row's slug,
+# so an entry left behind by a rolled back write costs a query instead of returning the wrong row.
+slug_ids = {
+    "posts": TTLCache(maxsize=SLUG_CACHE_SIZE, ttl=float("inf")),
+    "categories": TTLCache(maxsize=SLUG_CACHE_SIZE, ttl=float("inf")),
+}
+
+def remember_slug(table: str, old_slug: str | None, new_slug: str | None, id: int):
+    if old_slug != new_slug and old_slug is not None:
+        slug_ids[table].pop(old_slug)
+    if new_slug is not None:
+        slug_ids[table].set(new_slug, id)
+
+'''
+Response cache
+'''
+
+class MemoryBackend:
+    """Per-process LRU of serialized responses with a tag -> keys index for invalidation."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl, on_evict=self._forget)
+        self.tags = {}
+
+    def _forget(self, key, entry):
+        for tag in entry["tags"]:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    async def get(self, key):
+        return self.entries.get(key)
+
+    async def set(self, key, entry):
+        self.entries.set(key, entry)
+        for tag in entry["tags"]:
+            self.tags.setdefault(tag, set()).add(key)
+
+    async def invalidate(self, tags):
+        for tag in tags:
+            for key in self.tags.pop(tag, set()):
+                entry = self.entries.pop(key)
+                if entry is not None:
+                    self._forget(key, entry)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", **self.entries.stats(), "tags": len(self.tags)}
+
+class RedisBackend:
+    """Redis-compatible backend so every worker shares one cache."""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "blog:response:"):
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = json.loads(raw)
+        entry["body"] = entry["body"].encode("latin-1")
+        return entry
+
+    async def set(self, key, entry):
+        raw = json.dumps({**entry, "body": entry["body"].decode("latin-1")})
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(self.prefix + key, raw, ex=int(self.ttl))
+            for tag in entry["tags"]:
+                pipe.sadd(self.prefix + "tag:" + tag, key)
+                pipe.expire(self.prefix + "tag:" + tag, int(self.ttl))
+            await pipe.execute()
+
+    async def invalidate(self, tags):
+        for tag in tags:
+            tag_key = self.prefix + "tag:" + tag
+            keys = await self.client.smembers(tag_key)
+            await self.client.delete(tag_key, *(self.prefix + k.decode() for k in keys))
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+class ResponseCache:
+    """Caches pre-serialized JSON bodies keyed by path + query string, with ETag revalidation."""
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self._adapters = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def key_for(self, request: Request) -> str:
+        return request.url.path + "?" + "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+
+    def _respond(self, request: Request, entry: dict) -> Response:
+        headers = {**entry["headers"], "ETag": entry["etag"]}
+        if_none_match = request.headers.get("if-none-match", "")
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if entry["etag"] in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+    async def lookup(self, request: Request) -> Response | None:
+        if not self.enabled:
+            return None
+        entry = await self.backend.get(self.key_for(request))
+        return self._respond(request, entry) if entry is not None else None
+
+    async def store(self, request: Request, response_model, content, tags: list[str], headers: dict | None = None) -> Response:
+        adapter = self._adapters.get(response_model)
+        if adapter is None:
+            adapter = self._adapters[response_model] = TypeAdapter(response_model)
+        body = adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+        return await self.store_body(request, body, tags, headers)
+
+    async def store_rows(self, request: Request, rows, tags: list[str], headers: dict | None = None) -> Response:
+        # rows selected with serializers.response_columns, encoded without validation (FAST_JSON)
+        return await self.store_body(request, encode_rows(rows), tags, headers)
+
+    async def store_body(self, request: Request, body: bytes, tags: list[str], headers: dict | None = None) -> Response:
+        entry = {
+            "body": body,
+            "etag": '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"',
+            "headers": headers or {},
+            "tags": list(tags),
+        }
+        # a replica read right after a write may predate it, and would outlive the invalidation that write caused
+        if self.enabled and not getattr(request.state, "may_lag", False):
+            await self.backend.set(self.key_for(request), entry)
+        return self._respond(request, entry)
+
+    async def invalidate(self, *tags: str):
+        if self.enabled and tags:
+            await self.backend.invalidate(tags)
+
+    def stats(self) -> dict:
+        return self.backend.stats()
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 300))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 2048))
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+
+if RESPONSE_CACHE_URL and redis is None:
+    raise RuntimeError("RESPONSE_CACHE_URL is set but the 'redis' package is not installed")
+response_cache = ResponseCache(
+    RedisBackend(RESPONSE_CACHE_URL, RESPONSE_CACHE_TTL) if RESPONSE_CACHE_URL else MemoryBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL),
+    ttl=RESPONSE_CACHE_TTL,
+)
+
+def mark_stale(db, *tags: str):
+    # crud writes record what they touched; the cache is only purged once the transaction commits
+    db.info.setdefault("stale_cache_tags", set()).update(tags)
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed(session):
+    tags = session.info.pop("stale_cache_tags", None)
+    if tags:
+        # AsyncSession.commit() runs this hook inside its greenlet, so the backend can be awaited
+        await_only(response_cache.invalidate(*tags))
+
+@event.listens_for(Session, "after_transaction_end")
+def discard_stale(session, transaction):
+    # a rolled back savepoint keeps the outer transaction's tags; over-invalidating is harmless
+    if transaction.parent is None:
+        session.info.pop("stale_cache_tags", None)
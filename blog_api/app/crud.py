@@ -1,234 +1,641 @@
 # crud.py
-from models import User, Post, Comment, Category, Tag
-from sqlalchemy import select, delete
+from models import User, RevokedToken, Post, Comment, Category, Tag, posts_fts, tag_post_association, counter_rebuilds, comment_path, comment_subtree, COMMENT_PATH_WIDTH
+from sqlalchemy import select, insert, update, delete, and_, or_, func, literal_column, tuple_
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import NoResultFound, MultipleResultsFound
-from schemas import UserCreate, UserUpdate, PostCreate, PostUpdate, PostStatus, CommentCreate, CommentUpdate, CategoryCreate, CategoryUpdate, TagCreate, TagUpdate, PostTagsUpdate
+from schemas import ExportResource, UserCreate, UserUpdate, PostCreate, PostImport, PostUpdate, PostStatus, CommentCreate, CommentUpdate, CategoryCreate, CategoryUpdate, TagCreate, TagUpdate, PostTagsUpdate, PostTagsDelta
 from typing import TypeVar, Optional
-from security import hash_password # Import from the new security file
+from collections import Counter, defaultdict
+import math
+import time
+from datetime import datetime, timezone
+from security import hash_password_async # Import from the new security file
+from pagination import encode_cursor, decode_cursor, decode_datetime
+from cache import invalidate_user, revocations, ACCESS_TOKEN_LIFETIME, mark_stale, remember_slug, slug_ids
+from slugify import slugify
+from serializers import response_columns
+from events import publish
+
+'''
+Row selection
+'''
+
+def select_rows(model, schema=None):
+    # whole ORM objects, or with a response schema only its columns, as rows for serializers.encode_rows
+    return select(model) if schema is None else select(*response_columns(model, schema))
+
+async def fetch_rows(db: AsyncSession, stmt, schema=None):
+    result = await db.execute(stmt)
+    return result.all() if schema is not None else result.scalars().all()
+
+'''
+Counters
+'''
+
+async def adjust_counter(db: AsyncSession, counter, deltas: dict):
+    # counter is a column such as Post.comment_count, deltas maps row id -> change.
+    # One atomic UPDATE per distinct change, so concurrent writers never lose an increment.
+    model = counter.class_
+    ids_by_delta = defaultdict(list)
+    for id, delta in deltas.items():
+        if id is not None and delta:
+            ids_by_delta[delta].append(id)
+    for delta, ids in ids_by_delta.items():
+        await db.execute(update(model).where(model.id.in_(ids)).values({counter.key: counter + delta}))
+
+# response cache tags showing each counter, given the ids counter_rebuilds() returns; user counts aren't cached
+COUNTER_CACHE_TAGS = {
+    "posts.comment_count": lambda ids: ["posts", *(f"post:{id}" for id in ids)],
+    "users.post_count": lambda ids: [],
+    "categories.post_count": lambda ids: ["categories"],
+    "tags.post_count": lambda ids: ["tags"],
+    "comments.reply_count": lambda post_ids: [f"comments:post:{id}" for id in post_ids],
+}
+
+async def rebuild_counters(db: AsyncSession) -> dict[str, int]:
+    # recount every counter column; returns how many rows had drifted per counter
+    corrected = {}
+    for name, stmt in counter_rebuilds().items():
+        ids = (await db.execute(stmt)).scalars().all()
+        corrected[name] = len(ids)
+        if ids:
+            mark_stale(db, *COUNTER_CACHE_TAGS[name](set(ids)))
+    return corrected
 
 '''
 Users CRUD
 '''
 
-def get_users(db: Session):
-    stmt = select(User)
-    result = db.execute(stmt)
-    return result.scalars().all()
+async def get_users(db: AsyncSession, schema=None):
+    stmt = select_rows(User, schema)
+    return await fetch_rows(db, stmt, schema)
 
-def insert_user(db: Session, user: UserCreate):
+async def insert_user(db: AsyncSession, user: UserCreate):
     new_user = User(**user.model_dump(exclude_unset=True))
     db.add(new_user)
-    db.flush()
+    await db.flush()
     return new_user
 
-def get_user(db: Session, username: str) -> User:
+async def get_user(db: AsyncSession, username: str) -> User:
     stmt = select(User).where(User.username == username)
     try:
-        return db.execute(stmt).scalar_one()
+        return (await db.execute(stmt)).scalar_one()
     except NoResultFound:
         raise HTTPException(status_code=404, detail="User not found")
     except MultipleResultsFound:
         raise HTTPException(status_code=406, detail=f"Multiple users found with username '{username}'.")
 
-def update_user(db: Session, username: str, user_update:UserUpdate):
-    user = get_user(db, username)
+async def update_user(db: AsyncSession, username: str, user_update:UserUpdate):
+    user = await get_user(db, username)
     updt = user_update.model_dump(exclude_unset=True)
     if "password" in updt and updt["password"]:
-        updt["password_hash"] = hash_password(updt.pop("password"))
+        updt["password_hash"] = await hash_password_async(updt.pop("password"))
 
+    # tokens carry the username and role, so changing either (or the password) ends every session issued so far
+    revoke = "password_hash" in updt or any(col in updt and updt[col] != getattr(user, col) for col in ("username", "is_admin"))
     for col in updt:
         setattr(user, col, updt[col])
-    db.flush()
+    await db.flush()
+    invalidate_user(username, user.username)
+    if revoke:
+        await revoke_tokens(db, user_id=user.id)
     return user
 
-def delete_user(db: Session, username: str) -> User:
-    user_to_delete = get_user(db, username)
-    db.delete(user_to_delete)
-    db.flush()
+async def delete_user(db: AsyncSession, username: str) -> User:
+    user_to_delete = await get_user(db, username)
+    await db.delete(user_to_delete)
+    await db.flush()
+    invalidate_user(username)
+    await revoke_tokens(db, user_id=user_to_delete.id)
     return user_to_delete
+
+async def revoke_tokens(db: AsyncSession, jti: str | None = None, user_id: int | None = None, expires_at: float | None = None):
+    # one token by jti, or with only a user id every token of that user issued up to now
+    now = math.ceil(time.time() * 1e6) / 1e6 # the DB keeps microseconds, never round a revocation down
+    expires_at = expires_at or now + ACCESS_TOKEN_LIFETIME
+    db.add(RevokedToken(
+        jti=jti, user_id=None if jti else user_id,
+        revoked_at=datetime.fromtimestamp(now, timezone.utc).replace(tzinfo=None),
+        expires_at=datetime.fromtimestamp(expires_at, timezone.utc).replace(tzinfo=None),
+    ))
+    await db.flush()
+    # this worker stops accepting the token(s) at once, the others on their next revocation sync
+    revocations.add(jti, None if jti else user_id, now, expires_at)
     
 '''
 Posts CRUD
 '''
 
-def get_posts(db: Session, skip: int = 0, limit: int = 10, status: Optional[PostStatus] = None):
-    stmt = select(Post)
+def expanded_post_options():
+    # author/category ride along in the same SELECT, tags come from one extra IN query per page
+    return (
+        joinedload(Post.author),
+        joinedload(Post.category),
+        selectinload(Post.tags),
+    )
+
+async def get_posts(db: AsyncSession, skip: int = 0, limit: int = 10, status: Optional[PostStatus] = None, cursor: Optional[str] = None, expanded: bool = False, schema=None):
+    stmt = select_rows(Post, schema)
+    if expanded:
+        stmt = stmt.options(*expanded_post_options())
     if status:
         stmt = stmt.where(Post.status == status) 
-    stmt = stmt.offset(skip).limit(limit) 
-    result = db.execute(stmt)
-    return result.scalars().all()
+    if cursor:
+        # Keyset pagination: seek past the last (publication_date, id) seen instead of counting rows
+        last_date, last_id = decode_cursor(cursor, 2)
+        last_date = decode_datetime(last_date)
+        if not isinstance(last_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # a row-value comparison lets SQLite seek the (publication_date, id) indexes; the OR form scans
+        stmt = stmt.where(tuple_(Post.publication_date, Post.id) > tuple_(last_date, last_id))
+    else:
+        stmt = stmt.offset(skip)
+    stmt = stmt.order_by(Post.publication_date, Post.id).limit(limit) 
+    return await fetch_rows(db, stmt, schema)
+
+def post_cursor(post: Post) -> str:
+    return encode_cursor(post.publication_date, post.id)
 
-def get_post(db, id: int):
+async def get_post(db: AsyncSession, id: int):
     try:
         stmt = select(Post).where(Post.id == id)
-        result = db.execute(stmt)
+        result = await db.execute(stmt)
         return result.scalars().one()
     except NoResultFound:
         raise HTTPException(status_code=404, detail=f"Post not found ID:{id}")
     except MultipleResultsFound:
         raise HTTPException(status_code=409, detail=f"Multiple posts found with ID:{id}")
 
-def insert_post(db: Session, post: PostCreate):
+async def get_by_slug(db: AsyncSession, model, slug: str):
+    # the slug index usually turns this into a primary-key fetch;
+    # a missing or outdated entry falls back to the unique index on slug and is corrected
+    index = slug_ids[model.__tablename__]
+    id = index.get(slug)
+    if id is not None:
+        row = await db.get(model, id)
+        if row is not None and row.slug == slug:
+            return row
+        index.pop(slug)
+    row = (await db.execute(select(model).where(model.slug == slug))).scalar_one_or_none()
+    if row is not None:
+        index.set(slug, row.id)
+    return row
+
+async def warm_slug_index(db: AsyncSession):
+    # fill the slug index at startup: all categories, then the newest posts up to its size
+    for model, order in ((Category, Category.id), (Post, Post.publication_date.desc())):
+        index = slug_ids[model.__tablename__]
+        stmt = select(model.id, model.slug).where(model.slug.is_not(None)).order_by(order).limit(index.maxsize)
+        # the newest rows are set last, so they are the last ones the LRU would evict
+        for id, slug in reversed((await db.execute(stmt)).all()):
+            index.set(slug, id)
+
+async def get_post_by_slug(db: AsyncSession, slug: str):
+    post = await get_by_slug(db, Post, slug)
+    if post is None:
+        raise HTTPException(status_code=404, detail=f"Post not found slug:{slug}")
+    return post
+
+async def insert_post(db: AsyncSession, post: PostCreate):
     new_post = Post(**post.model_dump(exclude_unset=True))
     db.add(new_post)
-    db.flush()
+    await db.flush()
+    remember_slug("posts", None, new_post.slug, new_post.id)
+    await adjust_counter(db, User.post_count, {new_post.author_id: 1})
+    await adjust_counter(db, Category.post_count, {new_post.category_id: 1})
+    mark_stale(db, "posts", "categories")
+    publish(db, "post.created", ["posts", f"post:{new_post.id}"], f"post:{new_post.id}", id=new_post.id)
     return new_post
 
-def update_post(db: Session, post_id: int, post_update: PostUpdate):
-    post = get_post(db, post_id)
+async def bulk_insert_posts(db: AsyncSession, rows: list[tuple[int, PostImport]]):
+    # One chunk of an import: a handful of set-based statements regardless of chunk size.
+    # Returns the new post ids and per-row errors keyed by the caller's row index.
+    errors = []
+    category_ids = {row.category_id for _, row in rows}
+    author_ids = {row.author_id for _, row in rows}
+    known_categories = set((await db.execute(select(Category.id).where(Category.id.in_(category_ids)))).scalars())
+    known_authors = set((await db.execute(select(User.id).where(User.id.in_(author_ids)))).scalars())
+    valid = []
+    for index, row in rows:
+        if row.category_id not in known_categories:
+            errors.append({"index": index, "detail": f"Category with ID '{row.category_id}' not found"})
+        elif row.author_id not in known_authors:
+            errors.append({"index": index, "detail": f"User with ID '{row.author_id}' not found"})
+        else:
+            valid.append(row)
+    if not valid:
+        return [], errors
+
+    tag_names = {name for row in valid for name in row.tags}
+    tag_ids = {}
+    if tag_names:
+        existing = await db.execute(select(Tag.id, Tag.name).where(Tag.name.in_(tag_names)))
+        tag_ids = {name: id for id, name in existing}
+        missing = [{"name": name} for name in tag_names if name not in tag_ids]
+        if missing:
+            created = await db.execute(insert(Tag).returning(Tag.id, Tag.name), missing)
+            tag_ids.update({name: id for id, name in created})
+
+    values = [row.model_dump(exclude={"tags", "slug"}) for row in valid]
+    post_ids = (await db.execute(insert(Post).returning(Post.id, sort_by_parameter_order=True), values)).scalars().all()
+
+    # same "{slug}-{id}" scheme as create_post, unique because ids are.
+    # Imports don't fill the slug index, they would evict the warm entries; lookups fall back to the query.
+    await db.execute(update(Post), [
+        {"id": post_id, "slug": f"{row.slug or slugify(row.title)}-{post_id}"}
+        for post_id, row in zip(post_ids, valid)
+    ])
+    associations = [
+        {"post_id": post_id, "tag_id": tag_ids[name]}
+        for post_id, row in zip(post_ids, valid)
+        for name in set(row.tags)
+    ]
+    if associations:
+        await db.execute(insert(tag_post_association), associations)
+    await adjust_counter(db, User.post_count, Counter(row.author_id for row in valid))
+    await adjust_counter(db, Category.post_count, Counter(row.category_id for row in valid))
+    await adjust_counter(db, Tag.post_count, Counter(pair["tag_id"] for pair in associations))
+    mark_stale(db, "posts", "categories", "tags")
+    # one event per chunk rather than per post, imports would otherwise flush every client's queue
+    publish(db, "posts.imported", ["posts"], f"posts.imported:{post_ids[0]}", ids=post_ids)
+    return post_ids, errors
+
+async def update_post(db: AsyncSession, post_id: int, post_update: PostUpdate):
+    post = await get_post(db, post_id)
+    old_category_id, old_slug = post.category_id, post.slug
     updt = post_update.model_dump(exclude_unset=True)
     for col in updt:
         setattr(post, col, updt[col])
-    db.flush()
+    await db.flush()
+    remember_slug("posts", old_slug, post.slug, post.id)
+    mark_stale(db, f"post:{post_id}", "posts")
+    publish(db, "post.updated", ["posts", f"post:{post_id}"], f"post:{post_id}", id=post_id)
+    if post.category_id != old_category_id:
+        await adjust_counter(db, Category.post_count, {old_category_id: -1, post.category_id: 1})
+        mark_stale(db, "categories")
+    return post
+
+async def get_post_authors(db: AsyncSession, post_ids: list[int]) -> dict[int, int]:
+    # post id -> author id for the posts that exist, in one query
+    stmt = select(Post.id, Post.author_id).where(Post.id.in_(set(post_ids)))
+    return {id: author_id for id, author_id in await db.execute(stmt)}
+
+async def retag_posts(db: AsyncSession, changes: dict[int, tuple[Optional[set], set, set]]):
+    # changes maps post id -> (replacement tag ids or None, ids to add, ids to remove).
+    # Posts must exist; unknown tag ids are all reported in one 404.
+    # Only the pairs that actually change are inserted into / deleted from tag_post_association.
+    wanted = set()
+    for replace, add, remove in changes.values():
+        wanted |= (replace or set()) | add
+    known = set((await db.execute(select(Tag.id).where(Tag.id.in_(wanted)))).scalars()) if wanted else set()
+    missing = sorted(wanted - known)
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "Tags not found", "missing_tag_ids": missing})
+
+    current = {post_id: set() for post_id in changes}
+    pairs = select(tag_post_association.c.post_id, tag_post_association.c.tag_id).where(tag_post_association.c.post_id.in_(changes))
+    for post_id, tag_id in await db.execute(pairs):
+        current[post_id].add(tag_id)
+
+    results, to_insert, to_delete = [], [], []
+    tag_deltas = Counter()
+    for post_id, (replace, add, remove) in changes.items():
+        before = current[post_id]
+        after = ((before if replace is None else replace) | add) - remove
+        added, removed = after - before, before - after
+        to_insert += [{"post_id": post_id, "tag_id": tag_id} for tag_id in added]
+        to_delete += [(post_id, tag_id) for tag_id in removed]
+        tag_deltas.update(added)
+        tag_deltas.subtract(removed)
+        results.append({"post_id": post_id, "tag_ids": sorted(after), "added": sorted(added), "removed": sorted(removed)})
+
+    if to_delete:
+        await db.execute(delete(tag_post_association).where(
+            tuple_(tag_post_association.c.post_id, tag_post_association.c.tag_id).in_(to_delete)
+        ))
+    if to_insert:
+        await db.execute(insert(tag_post_association), to_insert)
+    if to_insert or to_delete:
+        await adjust_counter(db, Tag.post_count, tag_deltas)
+        mark_stale(db, "tags")
+    for result in results:
+        if result["added"] or result["removed"]:
+            publish(db, "post.updated", ["posts", f"post:{result['post_id']}"], f"post:{result['post_id']}", id=result["post_id"])
+    # the statements above bypass the ORM, so loaded collections on either side are stale
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, Post) and obj.id in changes:
+            db.expire(obj, ["tags"])
+        elif isinstance(obj, Tag):
+            db.expire(obj, ["posts"])
+    return results
+
+async def assign_tags_to_post(db: AsyncSession, post_id: int, tags_update: PostTagsUpdate):
+    post = await get_post(db, post_id)
+    await retag_posts(db, {post_id: (set(tags_update.tag_ids), set(), set())})
     return post
 
-def assign_tags_to_post(db: Session, post_id: int, tags_update: PostTagsUpdate):
-    post = get_post(db, post_id)
-    tag_objects = [get_tag(db, id) for id in tags_update.tag_ids]
-    post.tags = tag_objects
-    db.flush()
+async def change_post_tags(db: AsyncSession, post_id: int, delta: PostTagsDelta):
+    post = await get_post(db, post_id)
+    await retag_posts(db, {post_id: (None, set(delta.add), set(delta.remove))})
     return post
 
-def search_tag_posts(db: Session, tag_ids: list[int]):
-    stmt = select(Post)
+async def search_tag_posts(db: AsyncSession, tag_ids: list[int], expanded: bool = False, schema=None):
+    stmt = select_rows(Post, schema)
+    if expanded:
+        stmt = stmt.options(*expanded_post_options())
     stmt = stmt.join(Post.tags) 
     stmt = stmt.where(Tag.id.in_(tag_ids))
     stmt = stmt.distinct()
-    return db.execute(stmt).scalars().all()
+    return await fetch_rows(db, stmt, schema)
     
-def search_category_posts(db: Session, category_ids: list[int]):
-    stmt = select(Post)
+async def search_category_posts(db: AsyncSession, category_ids: list[int], expanded: bool = False, schema=None):
+    stmt = select_rows(Post, schema)
+    if expanded:
+        stmt = stmt.options(*expanded_post_options())
     stmt = stmt.join(Post.category) 
     stmt = stmt.where(Category.id.in_(category_ids))
     stmt = stmt.distinct()
-    return db.execute(stmt).scalars().all()
+    return await fetch_rows(db, stmt, schema)
+
+def fts_match_query(q: str) -> str:
+    # quote every term so user input is matched literally rather than parsed as FTS5 syntax
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+async def search_posts(db: AsyncSession, q: str, limit: int = 10, cursor: Optional[str] = None):
+    fts = literal_column("posts_fts")
+    hits = (
+        select(
+            posts_fts.c.rowid.label("post_id"),
+            func.bm25(fts, 4.0, 1.0).label("rank"), # lower is better, title weighted over content
+            func.snippet(fts, -1, "<mark>", "</mark>", "…", 24).label("snippet"),
+        )
+        .where(fts.op("MATCH")(fts_match_query(q)))
+        .subquery()
+    )
+    stmt = select(Post, hits.c.rank, hits.c.snippet).join(hits, hits.c.post_id == Post.id)
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor, 2)
+        if not isinstance(last_rank, (int, float)) or not isinstance(last_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(or_(
+            hits.c.rank > last_rank,
+            and_(hits.c.rank == last_rank, Post.id > last_id)
+        ))
+    stmt = stmt.order_by(hits.c.rank, Post.id).limit(limit)
+    return (await db.execute(stmt)).all()
 
-def delete_post(db: Session, post_id: int):
-    post_to_delete = get_post(db, post_id)
-    db.delete(post_to_delete)
-    db.flush()
+async def delete_post(db: AsyncSession, post_id: int):
+    post_to_delete = await get_post(db, post_id)
+    tag_ids = (await db.execute(select(tag_post_association.c.tag_id).where(tag_post_association.c.post_id == post_id))).scalars().all()
+    await db.delete(post_to_delete)
+    await db.flush()
+    remember_slug("posts", post_to_delete.slug, None, post_id)
+    await adjust_counter(db, User.post_count, {post_to_delete.author_id: -1})
+    await adjust_counter(db, Category.post_count, {post_to_delete.category_id: -1})
+    await adjust_counter(db, Tag.post_count, {tag_id: -1 for tag_id in tag_ids})
+    mark_stale(db, f"post:{post_id}", "posts", f"comments:post:{post_id}", "categories", "tags")
+    publish(db, "post.deleted", ["posts", f"post:{post_id}"], f"post:{post_id}", id=post_id)
     return post_to_delete
     
 '''
 Comments CRUD
 '''
 
-def get_comments(db: Session):
-    stmt = select(Comment)
-    result = db.execute(stmt)
-    return result.scalars().all()
+async def get_comments(db: AsyncSession, schema=None):
+    stmt = select_rows(Comment, schema)
+    return await fetch_rows(db, stmt, schema)
 
-def get_comment(db: Session, id: int):
+async def get_comment(db: AsyncSession, id: int):
     try:
         stmt = select(Comment).where(Comment.id == id)
-        result = db.execute(stmt)
+        result = await db.execute(stmt)
         return result.scalar_one()
     except NoResultFound:
         raise HTTPException(status_code=404, detail=f"Comment not found ID:{id}")
     except MultipleResultsFound:
         raise HTTPException(status_code=409, detail=f"Multiple comments found with ID:{id}")
 
-def insert_comment(db: Session, comment: CommentCreate):
+async def insert_comment(db: AsyncSession, comment: CommentCreate):
     new_comment = Comment(**comment.model_dump(exclude_unset=True))
+    parent = None
+    if new_comment.parent_id is not None:
+        parent = await get_comment(db, new_comment.parent_id)
+        if parent.post_id != new_comment.post_id:
+            raise HTTPException(status_code=400, detail=f"Comment ID:{parent.id} belongs to another post")
+        new_comment.depth = parent.depth + 1
     db.add(new_comment)
-    db.flush()
+    await db.flush()
+    # the path ends with the comment's own id, so it can only be set once the INSERT assigned one
+    new_comment.path = comment_path(parent.path if parent else None, new_comment.id)
+    await db.flush()
+    await adjust_counter(db, Post.comment_count, {new_comment.post_id: 1})
+    await adjust_counter(db, Comment.reply_count, {new_comment.parent_id: 1})
+    mark_stale(db, f"comments:post:{new_comment.post_id}", f"post:{new_comment.post_id}")
+    publish(db, "comment.created", ["comments", f"post:{new_comment.post_id}:comments"], f"comment:{new_comment.id}",
+            id=new_comment.id, post_id=new_comment.post_id, parent_id=new_comment.parent_id)
     return new_comment
 
-def update_comment(db: Session, comment_id: int, comment_update: CommentUpdate):
-    comment = get_comment(db, comment_id)
+async def update_comment(db: AsyncSession, comment_id: int, comment_update: CommentUpdate):
+    comment = await get_comment(db, comment_id)
+    old_post_id = comment.post_id
     updt = comment_update.model_dump(exclude_unset=True)
     for col in updt:
         setattr(comment, col, updt[col])
-    db.flush()
+    await db.flush()
+    mark_stale(db, f"comments:post:{old_post_id}", f"comments:post:{comment.post_id}")
+    publish(db, "comment.updated", ["comments", *{f"post:{old_post_id}:comments", f"post:{comment.post_id}:comments"}], f"comment:{comment.id}",
+            id=comment.id, post_id=comment.post_id, parent_id=comment.parent_id)
+    if comment.post_id != old_post_id:
+        await adjust_counter(db, Post.comment_count, {old_post_id: -1, comment.post_id: 1})
+        mark_stale(db, f"post:{old_post_id}", f"post:{comment.post_id}")
     
     return comment
     
-def delete_comment(db: Session, comment_id: int):
-    comment_to_delete = get_comment(db, comment_id)
-    db.delete(comment_to_delete)
-    db.flush()
+async def delete_comment(db: AsyncSession, comment_id: int):
+    # replies go with the comment: the whole subtree is one range delete
+    comment_to_delete = await get_comment(db, comment_id)
+    stmt = delete(Comment).where(Comment.post_id == comment_to_delete.post_id, comment_subtree(comment_to_delete.path))
+    removed = (await db.execute(stmt)).rowcount
+    await adjust_counter(db, Post.comment_count, {comment_to_delete.post_id: -removed})
+    await adjust_counter(db, Comment.reply_count, {comment_to_delete.parent_id: -1})
+    mark_stale(db, f"comments:post:{comment_to_delete.post_id}", f"post:{comment_to_delete.post_id}")
+    # its replies are gone too, clients drop the whole subtree
+    publish(db, "comment.deleted", ["comments", f"post:{comment_to_delete.post_id}:comments"], f"comment:{comment_id}",
+            id=comment_id, post_id=comment_to_delete.post_id, parent_id=comment_to_delete.parent_id, removed=removed)
     return comment_to_delete
+
+async def get_comment_thread(db: AsyncSession, comment_id: int, max_depth: Optional[int] = None, limit: int = 500, cursor: Optional[str] = None):
+    # a comment followed by all of its replies, depth-first, in path order; the cursor is the last path seen
+    root = await get_comment(db, comment_id)
+    stmt = select(Comment).where(Comment.post_id == root.post_id, comment_subtree(root.path))
+    if max_depth is not None:
+        stmt = stmt.where(Comment.depth <= root.depth + max_depth)
+    if cursor:
+        last_path, = decode_cursor(cursor, 1)
+        if not isinstance(last_path, str):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(Comment.path > last_path)
+    stmt = stmt.order_by(Comment.path).limit(limit)
+    return (await db.execute(stmt)).scalars().all()
     
 
 '''
 Categories CRUD
 '''
 
-def get_categories(db: Session):
-    stmt = select(Category)
-    result = db.execute(stmt)
-    return result.scalars().all()
-def get_category(db: Session, id: int):
+async def get_categories(db: AsyncSession, schema=None):
+    stmt = select_rows(Category, schema)
+    return await fetch_rows(db, stmt, schema)
+async def get_category(db: AsyncSession, id: int):
     try:
         stmt = select(Category).where(Category.id == id)
-        result = db.execute(stmt)
+        result = await db.execute(stmt)
         return result.scalar_one()
     except NoResultFound:
         raise HTTPException(status_code=404, detail=f"Category with ID '{id}' not found")
     except MultipleResultsFound:
         raise HTTPException(status_code=409, detail=f"Multiple categories found with ID:{id}")
-def insert_category(db: Session, category: CategoryCreate):
+async def get_category_by_slug(db: AsyncSession, slug: str):
+    category = await get_by_slug(db, Category, slug)
+    if category is None:
+        raise HTTPException(status_code=404, detail=f"Category with slug '{slug}' not found")
+    return category
+async def insert_category(db: AsyncSession, category: CategoryCreate):
     new_category = Category(**category.model_dump(exclude_unset=True))
     db.add(new_category)
-    db.flush()
+    await db.flush()
+    remember_slug("categories", None, new_category.slug, new_category.id)
+    mark_stale(db, "categories")
     return new_category
-def update_category(db: Session, category_id: int, category_update: CategoryUpdate):
-    category = get_category(db, category_id)
+async def update_category(db: AsyncSession, category_id: int, category_update: CategoryUpdate):
+    category = await get_category(db, category_id)
+    old_slug = category.slug
     updt = category_update.model_dump(exclude_unset=True)
     for col in updt:
         setattr(category, col, updt[col])
-    db.flush()
+    await db.flush()
+    remember_slug("categories", old_slug, category.slug, category.id)
+    mark_stale(db, "categories")
     
     return category
 
-def get_post_comments(db: Session, post_id: int):
-    stmt = select(Comment).where(Comment.post_id == post_id)
-    return db.execute(stmt).scalars().all()
+async def get_post_comments(db: AsyncSession, post_id: int, parent_id: Optional[int] = None, limit: int = 50, cursor: Optional[str] = None, replies: int = 0):
+    # One page of a level of the thread (top-level comments, or the direct replies to parent_id) ordered by id,
+    # plus up to `replies` of each one's replies. Returned flat in path order, so replies follow their comment.
+    stmt = select(Comment).where(Comment.post_id == post_id, Comment.parent_id == parent_id)
+    if cursor:
+        last_id, = decode_cursor(cursor, 1)
+        if not isinstance(last_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(Comment.id > last_id)
+    level = (await db.execute(stmt.order_by(Comment.id).limit(limit))).scalars().all()
+    if not level or replies <= 0:
+        return level
+
+    # the page's subtrees are contiguous in path order: one range from its first comment to past its last one,
+    # numbered within each subtree so only the first `replies` of every one are kept
+    depth = level[0].depth
+    subtree_key = func.substr(Comment.path, 1, (depth + 1) * (COMMENT_PATH_WIDTH + 1))
+    ranked = (
+        select(Comment.id, func.row_number().over(partition_by=subtree_key, order_by=Comment.path).label("position"))
+        .where(Comment.post_id == post_id, Comment.path > level[0].path, Comment.path < level[-1].path[:-1] + "0", Comment.depth > depth)
+        .subquery()
+    )
+    stmt = select(Comment).join(ranked, ranked.c.id == Comment.id).where(ranked.c.position <= replies)
+    nested = (await db.execute(stmt)).scalars().all()
+    return sorted([*level, *nested], key=lambda comment: comment.path)
 
-def get_post_author(db: Session, author_id: int):
+def comment_cursor(comment: Comment) -> str:
+    return encode_cursor(comment.id)
+
+async def get_post_author(db: AsyncSession, author_id: int):
     stmt = select(Post).where(Post.author_id == author_id)
-    return db.execute(stmt).scalars().all()
+    return (await db.execute(stmt)).scalars().all()
 
-def delete_category(db: Session, category_id: int):
-    category_to_delete = get_category(db, category_id)
-    db.delete(category_to_delete)
-    db.flush()
+async def delete_category(db: AsyncSession, category_id: int):
+    category_to_delete = await get_category(db, category_id)
+    await db.delete(category_to_delete)
+    await db.flush()
+    remember_slug("categories", category_to_delete.slug, None, category_id)
+    mark_stale(db, "categories")
     return category_to_delete
     
 '''
 Tags CRUD
 '''
 
-def get_tags(db: Session):
-    stmt = select(Tag)
-    result = db.execute(stmt)
-    return result.scalars().all()
-def get_tag(db: Session, id: int):
+async def get_tags(db: AsyncSession, schema=None):
+    stmt = select_rows(Tag, schema)
+    return await fetch_rows(db, stmt, schema)
+async def get_tag(db: AsyncSession, id: int):
     try:
         stmt = select(Tag).where(Tag.id == id)
-        result = db.execute(stmt)
+        result = await db.execute(stmt)
         return result.scalar_one()
     except NoResultFound:
         raise HTTPException(status_code=404, detail=f"Tag with '{id}' not found")
     except MultipleResultsFound:
         raise HTTPException(status_code=409, detail=f"Multiple tags found with ID:{id}")
-def insert_tag(db: Session, tag: TagCreate):
+async def insert_tag(db: AsyncSession, tag: TagCreate):
     new_tag = Tag(**tag.model_dump(exclude_unset=True))
     db.add(new_tag)
-    db.flush()
+    await db.flush()
+    mark_stale(db, "tags")
     return new_tag
-def update_tag(db: Session, tag_id: int, tag_update: TagUpdate):
-    tag = get_tag(db, tag_id)
+async def update_tag(db: AsyncSession, tag_id: int, tag_update: TagUpdate):
+    tag = await get_tag(db, tag_id)
     updt = tag_update.model_dump(exclude_unset=True)
     for col in updt:
         setattr(tag, col, updt[col])
-    db.flush()
+    await db.flush()
+    mark_stale(db, "tags")
     return tag
-def delete_tag(db: Session, tag_id: int):
-    tag_to_delete = get_tag(db, tag_id)
-    db.delete(tag_to_delete)
-    db.flush()
-    return tag_to_delete
\ No newline at end of file
+async def delete_tag(db: AsyncSession, tag_id: int):
+    tag_to_delete = await get_tag(db, tag_id)
+    await db.delete(tag_to_delete)
+    await db.flush()
+    mark_stale(db, "tags")
+    return tag_to_delete
+
+'''
+Exports
+'''
+
+EXPORT_MODELS = {
+    # resource: (model, date column, author column)
+    ExportResource.posts: (Post, Post.publication_date, Post.author_id),
+    ExportResource.comments: (Comment, Comment.created_at, Comment.author_id),
+    ExportResource.users: (User, User.created_at, User.id),
+    ExportResource.categories: (Category, None, None),
+    ExportResource.tags: (Tag, None, None),
+}
+
+def export_query(resource: ExportResource, status: Optional[PostStatus] = None, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None, author_id: Optional[int] = None):
+    model, date_column, author_column = EXPORT_MODELS[resource]
+    stmt = select(model).order_by(model.id)
+    if status is not None:
+        if model is not Post:
+            raise HTTPException(status_code=400, detail="status filter only applies to posts")
+        stmt = stmt.where(Post.status == status)
+    if since is not None or until is not None:
+        if date_column is None:
+            raise HTTPException(status_code=400, detail=f"date filters do not apply to {resource.value}")
+        if since is not None:
+            stmt = stmt.where(date_column >= since)
+        if until is not None:
+            stmt = stmt.where(date_column < until)
+    if author_id is not None:
+        if author_column is None:
+            raise HTTPException(status_code=400, detail=f"author filter does not apply to {resource.value}")
+        stmt = stmt.where(author_column == author_id)
+    return stmt
+
+async def stream_export(db: AsyncSession, stmt, batch_size: int = 1000):
+    # server-side cursor + yield_per: only one batch of rows is held at a time, and the
+    # session's weak identity map lets each batch be collected once it has been serialized
+    result = await db.stream_scalars(stmt.execution_options(yield_per=batch_size))
+    async for batch in result.partitions():
+        yield batch
@@ -1,15 +1,252 @@
-import sqlalchemy
-from models import Base
-from sqlalchemy.orm import sessionmaker, declarative_base
-
-engine = sqlalchemy.create_engine("sqlite:///test.db", connect_args={"check_same_thread": False}, echo=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-        
-Base.metadata.create_all(bind = engine)
\ No newline at end of file
+import asyncio
+import logging
+import os
+import time
+from fastapi import Request
+from models import Base, Comment, POSTS_FTS_DDL, comment_path, counter_rebuilds
+from instrumentation import instrument_engine
+from cache import TTLCache
+from sqlalchemy import bindparam, event, inspect, select, text
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///test.db")
+# comma separated, e.g. sqlite+aiosqlite:///file:replica.db?mode=ro&uri=true
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_STICKY = float(os.getenv("DB_REPLICA_STICKY", 5))  # seconds a client reads from the primary after writing
+DB_REPLICA_CHECK = float(os.getenv("DB_REPLICA_CHECK", 5))    # seconds between replica health checks
+
+logger = logging.getLogger("blog_api.database")
+
+'''
+Engine profile
+'''
+
+# PRAGMAs applied to every new SQLite connection; "rollback" is SQLite's stock behaviour
+SQLITE_PROFILES = {
+    "rollback": {},
+    "wal": {
+        "journal_mode": "WAL",          # readers no longer block behind a writer
+        "synchronous": "NORMAL",        # fsync at checkpoints only, safe with WAL
+        "busy_timeout": 5000,           # ms to wait for the write lock before "database is locked"
+        "cache_size": -64000,           # negative = KiB, so 64 MB of page cache per connection
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+}
+
+DB_PROFILE = os.getenv("DB_PROFILE", "wal")
+if DB_PROFILE not in SQLITE_PROFILES:
+    raise RuntimeError(f"Unknown DB_PROFILE '{DB_PROFILE}', expected one of {', '.join(SQLITE_PROFILES)}")
+
+def sqlite_pragmas() -> dict:
+    # any PRAGMA of the profile can be overridden individually, e.g. SQLITE_BUSY_TIMEOUT=10000
+    pragmas = dict(SQLITE_PROFILES[DB_PROFILE])
+    for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store"):
+        value = os.getenv(f"SQLITE_{name.upper()}")
+        if value:
+            pragmas[name] = value
+    return pragmas
+
+def engine_options(url: str) -> dict:
+    options = {"echo": os.getenv("DB_ECHO", "").lower() in ("1", "true", "yes")}
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options # a single shared in-memory connection, nothing to size
+    # one pool per worker process: enough connections for the requests a worker runs at once
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    options["pool_size"] = int(os.getenv("DB_POOL_SIZE", max(5, (os.cpu_count() or 1) * 2 // workers)))
+    options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", options["pool_size"]))
+    options["pool_timeout"] = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    options["pool_pre_ping"] = os.getenv("DB_POOL_PRE_PING", "").lower() in ("1", "true", "yes")
+    return options
+
+def use_sqlite_pragmas(engine, pragmas: dict):
+    @event.listens_for(engine.sync_engine, "connect")
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+instrument_engine(engine) # per-request statement counts and DB time, see instrumentation.py
+if engine.dialect.name == "sqlite":
+    use_sqlite_pragmas(engine, sqlite_pragmas())
+
+# expire_on_commit=False keeps returned ORM objects readable after commit without a lazy reload
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+'''
+Read replicas
+'''
+
+READ_METHODS = {"GET", "HEAD"}
+# journaling is the writer's business, and a read-only connection may not change it
+WRITER_PRAGMAS = {"journal_mode", "synchronous"}
+
+class Replica:
+    def __init__(self, url: str):
+        self.name = url if make_url(url).password is None else make_url(url).render_as_string(hide_password=True)
+        self.engine = create_async_engine(url, **engine_options(url))
+        instrument_engine(self.engine)
+        if self.engine.dialect.name == "sqlite":
+            use_sqlite_pragmas(self.engine, {k: v for k, v in sqlite_pragmas().items() if k not in WRITER_PRAGMAS})
+        self.sessionmaker = async_sessionmaker(bind=self.engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+        self.healthy = True
+        self.reads = 0
+        self.failures = 0
+
+class ReplicaRouter:
+    """Sends read-only requests to the healthy replicas in turn. A client that has just written reads
+    from the primary for DB_REPLICA_STICKY seconds so it sees its own write, and a replica that fails
+    is skipped until a health check reaches it again."""
+
+    def __init__(self, replicas: list[Replica], sticky: float):
+        self.replicas = replicas
+        self.writers = TTLCache(maxsize=100000, ttl=sticky) # client -> True while its reads stay on the primary
+        self.sticky = sticky
+        self.last_write = float("-inf")
+        self.next = 0
+        self.primary_reads = 0
+
+    def choose(self, client: str) -> Replica | None:
+        if not self.replicas:
+            return None
+        if self.writers.get(client) is None:
+            for offset in range(len(self.replicas)):
+                replica = self.replicas[(self.next + offset) % len(self.replicas)]
+                if replica.healthy:
+                    self.next = (self.next + offset + 1) % len(self.replicas)
+                    replica.reads += 1
+                    return replica
+        self.primary_reads += 1
+        return None
+
+    def wrote(self, client: str):
+        self.writers.set(client, True)
+        self.last_write = time.monotonic()
+
+    def may_lag(self) -> bool:
+        # a replica read this soon after a write in this process may not include it yet
+        return time.monotonic() - self.last_write < self.sticky
+
+    def failed(self, replica: Replica, exc: Exception):
+        if replica.healthy:
+            logger.warning("replica %s failed, reading from the others until it recovers: %s", replica.name, exc)
+        replica.healthy = False
+        replica.failures += 1
+
+    async def check(self):
+        for replica in self.replicas:
+            try:
+                async with replica.engine.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
+            except Exception as exc:
+                self.failed(replica, exc)
+            else:
+                if not replica.healthy:
+                    logger.info("replica %s is back", replica.name)
+                replica.healthy = True
+
+    def stats(self) -> dict:
+        return {
+            "primary_reads": self.primary_reads,
+            "sticky_clients": len(self.writers),
+            "replicas": [{"url": r.name, "healthy": r.healthy, "reads": r.reads, "failures": r.failures} for r in self.replicas],
+        }
+
+replicas = ReplicaRouter([Replica(url) for url in DATABASE_REPLICA_URLS], DB_REPLICA_STICKY)
+
+async def replica_health_loop():
+    while True:
+        await asyncio.sleep(DB_REPLICA_CHECK)
+        await replicas.check()
+
+def client_key(request: Request) -> str:
+    # whoever holds the token, or the address of an anonymous client
+    return request.headers.get("authorization") or "ip:" + (request.client.host if request.client else "unknown")
+
+def route_request(request: Request) -> Replica | None:
+    # the replica a request reads from, or None for the primary
+    client = client_key(request)
+    if request.method not in READ_METHODS:
+        replicas.wrote(client)
+        return None
+    replica = replicas.choose(client)
+    if replica is not None and replicas.may_lag():
+        request.state.may_lag = True # keeps the response out of the response cache
+    return replica
+
+async def get_db(request: Request):
+    replica = route_request(request)
+    if replica is None:
+        async with SessionLocal() as db:
+            try:
+                yield db
+            finally:
+                if request.method not in READ_METHODS:
+                    replicas.wrote(client_key(request)) # the window starts once the write is done
+        return
+    async with replica.sessionmaker() as db:
+        try:
+            yield db
+        except (OperationalError, InterfaceError) as exc:
+            replicas.failed(replica, exc)
+            raise
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        added = await conn.run_sync(add_missing_columns)
+        await conn.run_sync(create_missing_indexes)
+        if added:
+            await backfill_comment_paths(conn)
+            # counter columns start at 0 on an existing database, count what is already there
+            for stmt in counter_rebuilds().values():
+                await conn.execute(stmt)
+        if conn.dialect.name == "sqlite":
+            await create_search_index(conn)
+
+def add_missing_columns(sync_conn) -> list[str]:
+    # likewise for columns added to existing tables; only nullable columns or ones with a server default can be added this way
+    inspector = inspect(sync_conn)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and (column.nullable or column.server_default is not None):
+                column_type = column.type.compile(dialect=sync_conn.dialect)
+                null = "" if column.nullable else " NOT NULL"
+                default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+                sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{null}{default}"))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+async def backfill_comment_paths(conn):
+    # comments written before threading existed are all top-level
+    ids = (await conn.execute(select(Comment.id).where(Comment.path.is_(None)))).scalars().all()
+    if ids:
+        comments = Comment.__table__
+        stmt = comments.update().where(comments.c.id == bindparam("comment_id")).values(path=bindparam("comment_path"))
+        await conn.execute(stmt, [{"comment_id": id, "comment_path": comment_path(None, id)} for id in ids])
+
+def create_missing_indexes(sync_conn):
+    # create_all only builds indexes together with new tables; add ones declared since an existing table was created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+async def create_search_index(conn):
+    exists = (await conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'"))).first()
+    for statement in POSTS_FTS_DDL:
+        await conn.execute(text(statement))
+    if not exists:
+        # index posts that were written before the FTS table existed
+        await conn.execute(text("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')"))
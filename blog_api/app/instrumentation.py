@@ -0,0 +1,220 @@
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+logger = logging.getLogger("blog_api.slow_requests")
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 500))
+# Server-Timing tells any client how long the DB took; turn it off where that matters
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1").lower() in ("1", "true", "yes")
+
+class RequestStats:
+    """What one request spent its time on. Lives in a contextvar for the duration of the request."""
+
+    __slots__ = ("route", "statements", "db_seconds", "handler_seconds", "serialize_seconds")
+
+    def __init__(self):
+        self.route = None
+        self.statements = [] # (sql, seconds)
+        self.db_seconds = 0.0
+        self.handler_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+    @property
+    def slowest(self):
+        return max(self.statements, key=lambda item: item[1], default=None)
+
+current_stats: ContextVar[RequestStats | None] = ContextVar("current_stats", default=None)
+
+'''
+SQLAlchemy hooks
+'''
+
+def instrument_engine(engine):
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        stats = current_stats.get()
+        if stats is not None:
+            stats.statements.append((statement, elapsed))
+            stats.db_seconds += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def drop_timer(exception_context):
+        # a failed statement never reaches after_cursor_execute
+        started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+'''
+Route timing
+'''
+
+def _timed(fn, attribute: str):
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _add(attribute, time.perf_counter() - started)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _add(attribute, time.perf_counter() - started)
+    return wrapper
+
+def _add(attribute: str, seconds: float):
+    stats = current_stats.get()
+    if stats is not None:
+        setattr(stats, attribute, getattr(stats, attribute) + seconds)
+
+class InstrumentedRoute(APIRoute):
+    """APIRoute that times the endpoint body and the response_model validation/serialization separately."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _timed(endpoint, "handler_seconds"), **kwargs)
+
+    def get_route_handler(self):
+        field = self.response_field
+        if field is not None and not getattr(field, "_instrumented", False):
+            for name in ("validate", "serialize", "serialize_json"):
+                if hasattr(field, name):
+                    setattr(field, name, _timed(getattr(field, name), "serialize_seconds"))
+            field._instrumented = True
+        handler = super().get_route_handler()
+        path = self.path
+
+        async def instrumented_handler(request):
+            stats = current_stats.get()
+            if stats is not None:
+                stats.route = path
+            return await handler(request)
+        return instrumented_handler
+
+'''
+Middleware and Prometheus metrics
+'''
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    """Process-wide request counters rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}    # (method, route, status) -> count
+        self.durations = {}   # (method, route) -> [bucket counts..., sum, count]
+        self.db = {}          # (method, route) -> [statements, seconds]
+        self.serialize = {}   # (method, route) -> seconds
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        with self._lock:
+            key = (method, route)
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            histogram = self.durations.setdefault(key, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            db = self.db.setdefault(key, [0, 0.0])
+            db[0] += len(stats.statements)
+            db[1] += stats.db_seconds
+            self.serialize[key] = self.serialize.get(key, 0.0) + stats.serialize_seconds
+
+    def render(self) -> str:
+        def labels(method, route, **extra):
+            pairs = {"method": method, "route": route, **extra}
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs.items()) + "}"
+
+        lines = []
+        with self._lock:
+            lines += ["# HELP http_requests_total Requests handled, by route and status.", "# TYPE http_requests_total counter"]
+            lines += [f"http_requests_total{labels(m, r, status=s)} {n}" for (m, r, s), n in sorted(self.requests.items())]
+            lines += ["# HELP http_request_duration_seconds Time to handle a request, including streaming its body.", "# TYPE http_request_duration_seconds histogram"]
+            for (m, r), histogram in sorted(self.durations.items()):
+                for bound, count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(f"http_request_duration_seconds_bucket{labels(m, r, le=bound)} {count}")
+                lines.append(f"http_request_duration_seconds_bucket{labels(m, r, le='+Inf')} {histogram[-1]}")
+                lines.append(f"http_request_duration_seconds_sum{labels(m, r)} {histogram[-2]:.6f}")
+                lines.append(f"http_request_duration_seconds_count{labels(m, r)} {histogram[-1]}")
+            lines += ["# HELP db_statements_total SQL statements executed, by route.", "# TYPE db_statements_total counter"]
+            lines += [f"db_statements_total{labels(m, r)} {n}" for (m, r), (n, _) in sorted(self.db.items())]
+            lines += ["# HELP db_seconds_total Time spent executing SQL, by route.", "# TYPE db_seconds_total counter"]
+            lines += [f"db_seconds_total{labels(m, r)} {s:.6f}" for (m, r), (_, s) in sorted(self.db.items())]
+            lines += ["# HELP serialize_seconds_total Time spent validating and serializing response models, by route.", "# TYPE serialize_seconds_total counter"]
+            lines += [f"serialize_seconds_total{labels(m, r)} {s:.6f}" for (m, r), s in sorted(self.serialize.items())]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class InstrumentationMiddleware:
+    """Pure ASGI middleware: sets up RequestStats, adds Server-Timing, feeds /metrics and the slow-request log."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"server-timing", server_timing(stats, time.perf_counter() - started).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            route = stats.route or "unmatched"
+            metrics.observe(scope["method"], route, status, elapsed, stats)
+            if elapsed * 1000 >= SLOW_REQUEST_MS:
+                log_slow_request(scope, route, status, elapsed, stats)
+
+def server_timing(stats: RequestStats, total: float) -> str:
+    parts = [
+        f'db;dur={stats.db_seconds * 1000:.2f};desc="{len(stats.statements)} queries"',
+        f"handler;dur={stats.handler_seconds * 1000:.2f}",
+        f"serialize;dur={stats.serialize_seconds * 1000:.2f}",
+        f"total;dur={total * 1000:.2f}",
+    ]
+    slowest = stats.slowest
+    if slowest is not None:
+        parts.insert(1, f"db-slowest;dur={slowest[1] * 1000:.2f}")
+    return ", ".join(parts)
+
+def log_slow_request(scope, route: str, status: int, elapsed: float, stats: RequestStats):
+    queries = "\n".join(f"    {seconds * 1000:8.2f} ms  {' '.join(sql.split())[:500]}" for sql, seconds in stats.statements)
+    logger.warning(
+        "slow request %s %s (%s) -> %s in %.1f ms: %d queries / %.1f ms db, handler %.1f ms, serialize %.1f ms\n%s",
+        scope["method"], scope["path"], route, status, elapsed * 1000, len(stats.statements),
+        stats.db_seconds * 1000, stats.handler_seconds * 1000, stats.serialize_seconds * 1000, queries,
+    )
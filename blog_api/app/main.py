@@ -1,259 +1,607 @@
 # main.py
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
-from schemas import PostUpdate, PostCreate, PostResponse, PostStatus
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
+from schemas import PostUpdate, PostCreate, PostImport, PostImportReport, PostResponse, PostExpandedResponse, PostSearchResult, PostStatus
 from schemas import UserCreate,  UserUpdate, UserResponse
 from schemas import CommentCreate, CommentUpdate, CommentResponse
 from schemas import CategoryUpdate, CategoryCreate, CategoryResponse
 from schemas import TagUpdate, TagCreate, TagResponse
-from schemas import PostTagsUpdate
+from schemas import PostTagsUpdate, PostTagsDelta, PostTagsBulkUpdate, PostTagsResult
 from schemas import Token
+from schemas import ExportResource, ExportFormat
 from models import User
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from slugify import slugify
 from typing import Optional
 from crud import get_users, get_user, insert_user, update_user, delete_user
-from crud import get_post, get_posts, insert_post, update_post, delete_post, assign_tags_to_post, search_tag_posts, search_category_posts, get_post_comments, get_post_author
-from crud import get_comments, get_comment, insert_comment, update_comment, delete_comment
-from crud import get_categories, get_category, insert_category, update_category, delete_category
+from crud import get_post, get_post_by_slug, warm_slug_index, get_posts, post_cursor, insert_post, bulk_insert_posts, update_post, delete_post, get_post_authors, retag_posts, assign_tags_to_post, change_post_tags, search_posts, search_tag_posts, search_category_posts, get_post_comments, comment_cursor, get_post_author
+from crud import get_comments, get_comment, insert_comment, update_comment, delete_comment, get_comment_thread
+from crud import get_categories, get_category, get_category_by_slug, insert_category, update_category, delete_category
 from crud import get_tags, get_tag, insert_tag, update_tag, delete_tag
-from auth import create_access_token, get_current_user, require_admin
-from security import verify_password, hash_password # Import from the new security file
+from crud import export_query, stream_export, rebuild_counters, revoke_tokens
+from auth import create_access_token, get_current_user, get_current_user_record, get_token_claims, require_admin, sync_revocations, revocation_sync_loop
+from cache import invalidate_user, revocations, token_cache, user_cache, response_cache, slug_ids
+from security import verify_password_async, hash_password_async, password_hasher # Import from the new security file
 
 
-from database import get_db
+from database import get_db, create_tables, SessionLocal, replicas, replica_health_loop, route_request
+from instrumentation import InstrumentedRoute, InstrumentationMiddleware, metrics
+from ratelimit import AdmissionMiddleware, admission
+from events import bus, parse_topics, sse_stream, websocket_stream
+from serializers import FAST_JSON, FastJSONResponse, encode_rows
+from pagination import encode_cursor
 
 app = FastAPI(title="Blog API")
+app.router.route_class = InstrumentedRoute # must be set before the routes below are declared
+app.add_middleware(AdmissionMiddleware, routes=app.router.routes)
+app.add_middleware(InstrumentationMiddleware) # added last so it wraps admission and counts its 429/503 answers
+
+@app.on_event("startup")
+async def startup_event():
+    password_hasher.start()
+    await create_tables()
+    async with SessionLocal() as db:
+        await warm_slug_index(db)
+        await sync_revocations(db)
+    app.state.revocation_sync = asyncio.create_task(revocation_sync_loop())
+    if replicas.replicas:
+        await replicas.check()
+        app.state.replica_health = asyncio.create_task(replica_health_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.revocation_sync.cancel()
+    if replicas.replicas:
+        app.state.replica_health.cancel()
+    password_hasher.shutdown()
 
 @app.get("/", tags=["General"], summary="API Status Check")
-def read_root():
+async def read_root():
     return {"message": "Welcome to Blog API"}
 
 @app.post("/login", response_model=Token, tags=["Authentication"], summary="User Login & Token Generation")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = get_user(db, form_data.username)
-    if not verify_password(form_data.password, user.password_hash):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await get_user(db, form_data.username)
+    if not await verify_password_async(form_data.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     access_token = create_access_token(
-        data={"sub": user.username, "role": "admin" if user.is_admin else "user"}
+        data={"sub": user.username, "uid": user.id, "role": "admin" if user.is_admin else "user"}
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.post("/logout", tags=["Authentication"], summary="Revoke the presented token")
+async def logout(claims: dict = Depends(get_token_claims), db: AsyncSession = Depends(get_db)):
+    if claims.get("jti"):
+        await revoke_tokens(db, jti=claims["jti"], expires_at=claims["exp"])
+    elif claims.get("uid") is not None:
+        await revoke_tokens(db, user_id=claims["uid"])
+    await db.commit()
+    return {"detail": "Logged out"}
+
 '''
 Users Endpoints
 '''
 
 @app.post("/users/", response_model=UserResponse, tags=["Users"], summary="Create a new user")
-def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
     user_dict = user.model_dump(exclude_unset=True)
-    user_dict["password_hash"] = hash_password(user_dict.pop("password"))  # hash before saving
+    user_dict["password_hash"] = await hash_password_async(user_dict.pop("password"))  # hash before saving
     new_user = User(**user_dict)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @app.get("/users/{username}", response_model=UserResponse, tags=["Users"], summary="Get a user by username")
-def get_single_user(username: str, db: Session = Depends(get_db)):
-    return get_user(db, username)
+async def get_single_user(username: str, db: AsyncSession = Depends(get_db)):
+    return await get_user(db, username)
 @app.put("/users/{username}", response_model=UserResponse, tags=["Users"], summary="Change user data")
-def change_user_data(username: str, update: UserUpdate, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    user_to_update = get_user(db, username)
+async def change_user_data(username: str, update: UserUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    user_to_update = await get_user(db, username)
     if user_to_update.id != current_user.id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized to update this user")
-    new_user = update_user(db, username, update)
-    db.commit()
-    db.refresh(new_user)
+    new_user = await update_user(db, username, update)
+    await db.commit()
+    # drop again after commit so a concurrent request can't re-cache the old row
+    invalidate_user(username, new_user.username)
+    await db.refresh(new_user)
     return new_user
 @app.delete("/users/{username}", response_model=UserResponse, tags=["Users"], summary="Delete a user by username")
-def remove_user(username: str, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    deleted_user = delete_user(db, username)
-    db.commit()
+async def remove_user(username: str, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    deleted_user = await delete_user(db, username)
+    await db.commit()
+    invalidate_user(username)
     return deleted_user
 @app.get("/users/", response_model=list[UserResponse], tags=["Users"], summary="List all registered users")
-def list_users(db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    return get_users(db)
+async def list_users(db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    if FAST_JSON:
+        return FastJSONResponse(encode_rows(await get_users(db, schema=UserResponse)))
+    return await get_users(db)
+@app.get("/admin/metrics", tags=["General"], summary="Internal performance counters")
+async def admin_metrics(current_user: User = Depends(require_admin)):
+    return {
+        "password_hashing": password_hasher.stats(),
+        "auth_cache": {"tokens": token_cache.stats(), "users": user_cache.stats(), "revocations": revocations.stats()},
+        "response_cache": response_cache.stats(),
+        "slug_index": {table: index.stats() for table, index in slug_ids.items()},
+        "admission": admission.stats(),
+        "events": bus.stats(),
+        "replicas": replicas.stats(),
+    }
+@app.post("/admin/counters/rebuild", tags=["General"], summary="Recount the post/comment counter columns")
+async def reconcile_counters(db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    corrected = await rebuild_counters(db)
+    await db.commit()
+    return {"corrected": corrected}
+@app.get("/metrics", response_class=PlainTextResponse, tags=["General"], summary="Prometheus metrics")
+async def prometheus_metrics():
+    return metrics.render()
 @app.get("/me", response_model=UserResponse, tags=["Users"], summary="Show current logged in user")
-def get_user_role(current_user: dict = Depends(get_current_user)):
+async def get_user_role(current_user: User = Depends(get_current_user_record)):
     return current_user
 '''
 Posts Endpoints
 '''
+@app.get("/posts/by-slug/{slug}", response_model=PostResponse, tags=["Posts"], summary="Get a single post by its slug")
+async def get_post_from_slug(slug: str, request: Request, db: AsyncSession = Depends(get_db)):
+    cached = await response_cache.lookup(request)
+    if cached is not None:
+        return cached
+    post = await get_post_by_slug(db, slug)
+    return await response_cache.store(request, PostResponse, post, tags=[f"post:{post.id}"])
 @app.post("/posts/", response_model=PostResponse, tags=["Posts"], summary="Create a new post")
-def create_post(post: PostCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def create_post(post: PostCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     post.author_id = current_user.id
-    new_post = insert_post(db, post)
+    new_post = await insert_post(db, post)
     original_slug = post.slug if post.slug else slugify(post.title)
     unique_slug = f"{original_slug}-{new_post.id}"
     update_data = PostUpdate(slug=unique_slug)
-    updated_post = update_post(db, new_post.id, update_data)
-    db.commit()
-    db.refresh(updated_post)
+    updated_post = await update_post(db, new_post.id, update_data)
+    await db.commit()
+    await db.refresh(updated_post)
     return updated_post
 
+async def read_import_rows(request: Request):
+    # yields (index, raw row); NDJSON bodies are parsed line by line as they stream in
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        index, buffer = 0, b""
+        async for chunk in request.stream():
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, line
+                    index += 1
+        if buffer.strip():
+            yield index, buffer
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(body, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        for index, item in enumerate(body):
+            yield index, item
+
+@app.post("/posts/bulk", response_model=PostImportReport, tags=["Posts"], summary="Import many posts (JSON array or NDJSON) in one transaction")
+async def import_posts(
+    request: Request,
+    chunk_size: int = Query(500, ge=1, le=5000),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    post_ids, errors, chunk = [], [], []
+
+    async def flush_chunk():
+        try:
+            async with db.begin_nested():
+                ids, chunk_errors = await bulk_insert_posts(db, chunk)
+        except SQLAlchemyError as e:
+            # the savepoint is rolled back, earlier chunks are kept
+            ids, chunk_errors = [], [{"index": index, "detail": str(getattr(e, "orig", e))} for index, _ in chunk]
+        post_ids.extend(ids)
+        errors.extend(chunk_errors)
+        chunk.clear()
+
+    async for index, raw in read_import_rows(request):
+        try:
+            row = PostImport.model_validate_json(raw) if isinstance(raw, bytes) else PostImport.model_validate(raw)
+        except ValidationError as e:
+            errors.append({"index": index, "detail": json.loads(e.json(include_url=False))})
+            continue
+        if not current_user.is_admin:
+            row.author_id = current_user.id
+        chunk.append((index, row))
+        if len(chunk) >= chunk_size:
+            await flush_chunk()
+    if chunk:
+        await flush_chunk()
+    await db.commit()
+    return {"created": len(post_ids), "post_ids": post_ids, "errors": sorted(errors, key=lambda e: e["index"])}
+
+@app.get("/posts/expanded", response_model=list[PostExpandedResponse], tags=["Posts"], summary="Retrieve posts with author, category, tags and comment count embedded")
+async def list_posts_expanded(
+    response: Response,
+    skip: int = 0,
+    limit: int = 10,
+    status: Optional[PostStatus] = None,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    posts = await get_posts(db, skip=skip, limit=limit, status=status, cursor=cursor, expanded=True)
+    if limit > 0 and len(posts) == limit:
+        response.headers["X-Next-Cursor"] = post_cursor(posts[-1])
+    return posts
+
+@app.get("/posts/search", response_model=list[PostSearchResult], tags=["Posts"], summary="Full-text search over post titles and content")
+async def full_text_search_posts(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    rows = await search_posts(db, q, limit=limit, cursor=cursor)
+    if limit > 0 and len(rows) == limit:
+        last_post, last_rank, _ = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last_rank, last_post.id)
+    return [
+        PostSearchResult(**PostResponse.model_validate(post, from_attributes=True).model_dump(), rank=rank, snippet=snippet)
+        for post, rank, snippet in rows
+    ]
+
 @app.get("/posts/{post_id}", response_model=PostResponse, tags=["Posts"], summary="Get a single post by post ID")
-def get_single_post(post_id: int, db: Session = Depends(get_db)):
-    return get_post(db, post_id)
+async def get_single_post(post_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    cached = await response_cache.lookup(request)
+    if cached is not None:
+        return cached
+    post = await get_post(db, post_id)
+    return await response_cache.store(request, PostResponse, post, tags=[f"post:{post_id}"])
 @app.get("/posts/search/tags", response_model=list[PostResponse], tags=["Posts"], summary="Retrieve posts by filtering on a list of tag IDs")
-def get_posts_by_tags(
-    tag_ids: list[int] = Depends(lambda ids: ids), # FastAPI will automatically parse 'tag_ids=1&tag_ids=3' into a list[int]
-    db: Session = Depends(get_db)
+async def get_posts_by_tags(
+    tag_ids: list[int] = Query(...), # FastAPI will automatically parse 'tag_ids=1&tag_ids=3' into a list[int]
+    db: AsyncSession = Depends(get_db)
 ):
-    return search_tag_posts(db, tag_ids)
+    if FAST_JSON:
+        return FastJSONResponse(encode_rows(await search_tag_posts(db, tag_ids, schema=PostResponse)))
+    return await search_tag_posts(db, tag_ids)
+@app.get("/posts/search/tags/expanded", response_model=list[PostExpandedResponse], tags=["Posts"], summary="Retrieve expanded posts by filtering on a list of tag IDs")
+async def get_expanded_posts_by_tags(
+    tag_ids: list[int] = Query(...),
+    db: AsyncSession = Depends(get_db)
+):
+    return await search_tag_posts(db, tag_ids, expanded=True)
 @app.get("/posts/search/category", response_model=list[PostResponse], tags=["Posts"], summary="Retrieve posts by filtering on a list of category IDs")
-def get_posts_by_categories(
-    category_ids: list[int] = Depends(lambda ids: ids),
-    db: Session = Depends(get_db)
+async def get_posts_by_categories(
+    category_ids: list[int] = Query(...),
+    db: AsyncSession = Depends(get_db)
+):
+    if FAST_JSON:
+        return FastJSONResponse(encode_rows(await search_category_posts(db, category_ids, schema=PostResponse)))
+    return await search_category_posts(db, category_ids)
+@app.get("/posts/search/category/expanded", response_model=list[PostExpandedResponse], tags=["Posts"], summary="Retrieve expanded posts by filtering on a list of category IDs")
+async def get_expanded_posts_by_categories(
+    category_ids: list[int] = Query(...),
+    db: AsyncSession = Depends(get_db)
 ):
-    return search_category_posts(db, category_ids)
+    return await search_category_posts(db, category_ids, expanded=True)
 @app.put("/posts/{post_id}", response_model=PostResponse, tags=["Posts"], summary="Update an existing post's data")
-def change_post_data(post_id: int, update: PostUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    post_to_update = get_post(db, post_id)
+async def change_post_data(post_id: int, update: PostUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    post_to_update = await get_post(db, post_id)
     if post_to_update.author_id != current_user.id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized to update this post")
-    updated_post = update_post(db, post_id, update)
-    db.commit()
-    db.refresh(updated_post)
+    updated_post = await update_post(db, post_id, update)
+    await db.commit()
+    await db.refresh(updated_post)
     return updated_post
 @app.delete("/posts/{post_id}", response_model=PostResponse, tags=["Posts"], summary="Delete a post by its ID")
-def remove_post(post_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    post_to_delete = get_post(db, post_id)
+async def remove_post(post_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    post_to_delete = await get_post(db, post_id)
     if post_to_delete.author_id != current_user.id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized to delete this post")
-    deleted_post = delete_post(db, post_id)
-    db.commit()
+    deleted_post = await delete_post(db, post_id)
+    await db.commit()
     return deleted_post
 @app.get("/posts/", response_model=list[PostResponse], tags=["Posts"], summary="Retrieve a list of posts with pagination and optional filtering")
-def list_posts(
+async def list_posts(
+    request: Request,
     skip: int = 0, 
     limit: int = 10, 
     status: Optional[PostStatus] = None, # New optional filter
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None, # Opaque cursor from X-Next-Cursor, takes precedence over skip
+    db: AsyncSession = Depends(get_db)
 ):
+    cached = await response_cache.lookup(request)
+    if cached is not None:
+        return cached
     # Pass the new status parameter to the CRUD function
-    return get_posts(db, skip=skip, limit=limit, status=status)
+    posts = await get_posts(db, skip=skip, limit=limit, status=status, cursor=cursor, schema=PostResponse if FAST_JSON else None)
+    headers = {}
+    if limit > 0 and len(posts) == limit:
+        headers["X-Next-Cursor"] = post_cursor(posts[-1])
+    # per-post tags too, so a new comment only drops the pages showing that post's comment_count
+    tags = ["posts", *(f"post:{post.id}" for post in posts)]
+    if FAST_JSON:
+        return await response_cache.store_rows(request, posts, tags=tags, headers=headers)
+    return await response_cache.store(request, list[PostResponse], posts, tags=tags, headers=headers)
 @app.patch(
             "/posts/{post_id}/tags", 
            response_model=PostResponse, 
            tags=["Posts"], 
            summary="Assign or replace all tags for a post"
            )
-def set_post_tags(
+async def set_post_tags(
     post_id: int, 
     tags_update: PostTagsUpdate, 
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_db), 
     current_user: User = Depends(get_current_user)
 ):
-    post_to_update = get_post(db, post_id)
+    post_to_update = await get_post(db, post_id)
     if post_to_update.author_id != current_user.id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized to update tags for this post")
-    updated_post = assign_tags_to_post(db, post_id, tags_update)
-    db.commit()
-    db.refresh(updated_post)
+    updated_post = await assign_tags_to_post(db, post_id, tags_update)
+    await db.commit()
+    await db.refresh(updated_post)
     
     return updated_post
+@app.patch("/posts/{post_id}/tags/delta", response_model=PostResponse, tags=["Posts"], summary="Add and/or remove tags on a post without replacing the rest")
+async def add_remove_post_tags(
+    post_id: int,
+    delta: PostTagsDelta,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    post_to_update = await get_post(db, post_id)
+    if post_to_update.author_id != current_user.id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized to update tags for this post")
+    updated_post = await change_post_tags(db, post_id, delta)
+    await db.commit()
+    return updated_post
+@app.patch("/posts/tags/bulk", response_model=list[PostTagsResult], tags=["Posts"], summary="Retag many posts in one transaction")
+async def bulk_set_post_tags(
+    bulk: PostTagsBulkUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    post_ids = [item.post_id for item in bulk.items]
+    if len(set(post_ids)) != len(post_ids):
+        raise HTTPException(status_code=400, detail="Each post may only appear once per request")
+    authors = await get_post_authors(db, post_ids)
+    missing = sorted(set(post_ids) - authors.keys())
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "Posts not found", "missing_post_ids": missing})
+    forbidden = sorted(id for id, author_id in authors.items() if author_id != current_user.id and not current_user.is_admin)
+    if forbidden:
+        raise HTTPException(status_code=403, detail={"message": "Not authorized to update tags for these posts", "post_ids": forbidden})
+    results = await retag_posts(db, {
+        item.post_id: (None if item.tag_ids is None else set(item.tag_ids), set(item.add), set(item.remove))
+        for item in bulk.items
+    })
+    await db.commit()
+    return results
 
-@app.get("/posts/{post_id}/comments", response_model=list[CommentResponse], tags=["Comments"], summary="Retrieve all comments for a specific post")
-def list_post_comments(
+@app.get("/posts/{post_id}/comments", response_model=list[CommentResponse], tags=["Comments"], summary="Retrieve a page of a post's comment threads")
+async def list_post_comments(
     post_id: int, 
-    db: Session = Depends(get_db)
+    request: Request,
+    parent_id: Optional[int] = None, # list the replies to this comment instead of the top-level comments
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None, # from X-Next-Cursor, pages through the same level
+    replies: int = Query(0, ge=0, le=100), # also include the first N replies of each comment, depth-first
+    db: AsyncSession = Depends(get_db)
 ):
-    return get_post_comments(db, post_id)
+    cached = await response_cache.lookup(request)
+    if cached is not None:
+        return cached
+    comments = await get_post_comments(db, post_id, parent_id=parent_id, limit=limit, cursor=cursor, replies=replies)
+    level = [comment for comment in comments if comment.parent_id == parent_id]
+    headers = {}
+    if len(level) == limit:
+        headers["X-Next-Cursor"] = comment_cursor(level[-1])
+    return await response_cache.store(request, list[CommentResponse], comments, tags=[f"comments:post:{post_id}"], headers=headers)
 
 @app.get("/posts/{user_id}", response_model=list[PostResponse], tags=["Posts"], summary="Retrieve all posts by a specific user.")
-def list_comments_post(
+async def list_comments_post(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    return get_post_author(db, user_id)
+    return await get_post_author(db, user_id)
 
 '''
 Comments Endpoints
 '''
 @app.post("/comments/", response_model=CommentResponse, tags=["Comments"], summary="Create a new comment")
-def create_comment(comment: CommentCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def create_comment(comment: CommentCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     comment.author_id = current_user.id
-    new_comment = insert_comment(db, comment)
-    db.commit()
-    db.refresh(new_comment)
+    new_comment = await insert_comment(db, comment)
+    await db.commit()
+    await db.refresh(new_comment)
     return new_comment
 @app.get("/comments/{comment_id}", response_model=CommentResponse, tags=["Comments"], summary="Get a single comment by its ID")
-def get_single_comment(comment_id: int, db: Session = Depends(get_db)):
-    return get_comment(db, comment_id)
+async def get_single_comment(comment_id: int, db: AsyncSession = Depends(get_db)):
+    return await get_comment(db, comment_id)
+@app.get("/comments/{comment_id}/thread", response_model=list[CommentResponse], tags=["Comments"], summary="Get a comment and all of its replies, depth-first")
+async def get_thread(
+    comment_id: int,
+    response: Response,
+    max_depth: Optional[int] = Query(None, ge=0), # levels of replies below the comment
+    limit: int = Query(500, ge=1, le=5000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    comments = await get_comment_thread(db, comment_id, max_depth=max_depth, limit=limit, cursor=cursor)
+    if len(comments) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(comments[-1].path)
+    return comments
 @app.put("/comments/{comment_id}", response_model=CommentResponse, tags=["Comments"], summary="Update a comment's data")
-def change_comment_data(comment_id: int, update: CommentUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    comment_to_update = get_comment(db, comment_id)
+async def change_comment_data(comment_id: int, update: CommentUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    comment_to_update = await get_comment(db, comment_id)
     if comment_to_update.author_id != current_user.id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized to update this comment")
-    updated_comment = update_comment(db, comment_id, update)
-    db.commit()
-    db.refresh(updated_comment)
+    updated_comment = await update_comment(db, comment_id, update)
+    await db.commit()
+    await db.refresh(updated_comment)
     return updated_comment
-@app.delete("/comments/{comment_id}", response_model=CommentResponse, tags=["Comments"], summary="Delete a comment")
-def remove_comment(comment_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    comment_to_delete = get_comment(db, comment_id)
+@app.delete("/comments/{comment_id}", response_model=CommentResponse, tags=["Comments"], summary="Delete a comment and its replies")
+async def remove_comment(comment_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    comment_to_delete = await get_comment(db, comment_id)
     if comment_to_delete.author_id != current_user.id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized to delete this comment")
-    deleted_comment = delete_comment(db, comment_id)
-    db.commit()
+    deleted_comment = await delete_comment(db, comment_id)
+    await db.commit()
     return deleted_comment
 @app.get("/comments/", response_model=list[CommentResponse], tags=["Comments"], summary="List all comments")
-def list_comments(db: Session = Depends(get_db)):
-    return get_comments(db)
+async def list_comments(db: AsyncSession = Depends(get_db)):
+    if FAST_JSON:
+        return FastJSONResponse(encode_rows(await get_comments(db, schema=CommentResponse)))
+    return await get_comments(db)
 '''
 Categories Endpoints
 '''
 @app.post("/categories/", response_model=CategoryResponse, tags=["Categories"], summary="Create a category")
-def create_category(category: CategoryCreate, db: Session = Depends(get_db)):
-    new_category = insert_category(db, category)
+async def create_category(category: CategoryCreate, db: AsyncSession = Depends(get_db)):
+    new_category = await insert_category(db, category)
     original_slug = category.slug if category.slug else slugify(category.name)
     unique_slug = f"{original_slug}-{new_category.id}"
     update_data = CategoryUpdate(slug=unique_slug)
-    update_category(db, new_category.id, update_data)
-    db.commit()
-    db.refresh(new_category)
+    await update_category(db, new_category.id, update_data)
+    await db.commit()
+    await db.refresh(new_category)
     return new_category
+@app.get("/categories/by-slug/{slug}", response_model=CategoryResponse, tags=["Categories"], summary="Get a single category by its slug")
+async def get_category_from_slug(slug: str, request: Request, db: AsyncSession = Depends(get_db)):
+    cached = await response_cache.lookup(request)
+    if cached is not None:
+        return cached
+    category = await get_category_by_slug(db, slug)
+    return await response_cache.store(request, CategoryResponse, category, tags=["categories"])
 @app.get("/categories/{category_id}", response_model=CategoryResponse, tags=["Categories"], summary="Get a single category by its ID")
-def get_single_category(category_id: int, db: Session = Depends(get_db)):
-    return get_category(db, category_id)
+async def get_single_category(category_id: int, db: AsyncSession = Depends(get_db)):
+    return await get_category(db, category_id)
 @app.put("/categories/{category_id}", response_model=CategoryResponse, tags=["Categories"], summary="Update a category's data")
-def change_category_data(category_id: int, update: CategoryUpdate, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    updated_category = update_category(db, category_id, update)
-    db.commit()
-    db.refresh(updated_category)
+async def change_category_data(category_id: int, update: CategoryUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    updated_category = await update_category(db, category_id, update)
+    await db.commit()
+    await db.refresh(updated_category)
     return updated_category
 @app.delete("/categories/{category_id}", response_model=CategoryResponse, tags=["Categories"], summary="Remove a category")
-def remove_category(category_id: int, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    deleted_category = delete_category(db, category_id)
-    db.commit()
+async def remove_category(category_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    deleted_category = await delete_category(db, category_id)
+    await db.commit()
     return deleted_category
 @app.get("/categories/", response_model=list[CategoryResponse], tags=["Categories"], summary="List all categories")
-def list_categories(db: Session = Depends(get_db)):
-    return get_categories(db)
+async def list_categories(request: Request, db: AsyncSession = Depends(get_db)):
+    cached = await response_cache.lookup(request)
+    if cached is not None:
+        return cached
+    if FAST_JSON:
+        return await response_cache.store_rows(request, await get_categories(db, schema=CategoryResponse), tags=["categories"])
+    categories = await get_categories(db)
+    return await response_cache.store(request, list[CategoryResponse], categories, tags=["categories"])
 '''
 Tags Endpoints
 '''
 @app.post("/tags/", response_model=TagResponse, tags=["Tags"], summary="Create a tag")
-def create_tag(tag: TagCreate, db: Session = Depends(get_db)):
-    new_tag = insert_tag(db, tag)
-    db.commit()
-    db.refresh(new_tag)
+async def create_tag(tag: TagCreate, db: AsyncSession = Depends(get_db)):
+    new_tag = await insert_tag(db, tag)
+    await db.commit()
+    await db.refresh(new_tag)
     return new_tag
 @app.get("/tags/{tag_id}", response_model=TagResponse, tags=["Tags"], summary="Get a tag by its ID")
-def get_single_tag(tag_id: int, db: Session = Depends(get_db)):
-    return get_tag(db, tag_id)
+async def get_single_tag(tag_id: int, db: AsyncSession = Depends(get_db)):
+    return await get_tag(db, tag_id)
 @app.put("/tags/{tag_id}", response_model=TagResponse, tags=["Tags"], summary="Update a tag's data")
-def change_tag_data(tag_id: int, update: TagUpdate, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    updated_tag = update_tag(db, tag_id, update)
-    db.commit()
-    db.refresh(updated_tag)
+async def change_tag_data(tag_id: int, update: TagUpdate, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    updated_tag = await update_tag(db, tag_id, update)
+    await db.commit()
+    await db.refresh(updated_tag)
     return updated_tag
 @app.delete("/tags/{tag_id}", response_model=TagResponse, tags=["Tags"], summary="Delete a tag")
-def remove_tag(tag_id: int, db: Session = Depends(get_db), current_user: User = Depends(require_admin)):
-    tag = delete_tag(db, tag_id)
-    db.commit()
+async def remove_tag(tag_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(require_admin)):
+    tag = await delete_tag(db, tag_id)
+    await db.commit()
     return tag
 @app.get("/tags/", response_model=list[TagResponse], tags=["Tags"], summary="List all tags")
-def list_tags(db: Session = Depends(get_db)):
-    return get_tags(db)
\ No newline at end of file
+async def list_tags(request: Request, db: AsyncSession = Depends(get_db)):
+    cached = await response_cache.lookup(request)
+    if cached is not None:
+        return cached
+    if FAST_JSON:
+        return await response_cache.store_rows(request, await get_tags(db, schema=TagResponse), tags=["tags"])
+    tags = await get_tags(db)
+    return await response_cache.store(request, list[TagResponse], tags, tags=["tags"])
+'''
+Export Endpoints
+'''
+EXPORT_SCHEMAS = {
+    ExportResource.posts: PostResponse,
+    ExportResource.comments: CommentResponse,
+    ExportResource.users: UserResponse,
+    ExportResource.categories: CategoryResponse,
+    ExportResource.tags: TagResponse,
+}
+
+async def export_body(stmt, schema, format: ExportFormat, sessionmaker=SessionLocal):
+    # Own session: the request's get_db session is closed before a streamed body is sent
+    async with sessionmaker() as db:
+        columns = list(schema.model_fields)
+        if format == ExportFormat.csv:
+            yield ",".join(columns) + "\r\n"
+        async for batch in stream_export(db, stmt):
+            rows = [schema.model_validate(obj, from_attributes=True).model_dump(mode="json") for obj in batch]
+            if format == ExportFormat.csv:
+                buffer = io.StringIO()
+                csv.DictWriter(buffer, fieldnames=columns).writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(row) + "\n" for row in rows)
+
+@app.get("/export/{resource}", tags=["Export"], summary="Stream a whole table as NDJSON or CSV")
+async def export_rows(
+    request: Request,
+    resource: ExportResource,
+    format: ExportFormat = ExportFormat.ndjson,
+    status: Optional[PostStatus] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    author_id: Optional[int] = None,
+    current_user: User = Depends(require_admin)
+):
+    stmt = export_query(resource, status=status, since=since, until=until, author_id=author_id)
+    media_type = "text/csv" if format == ExportFormat.csv else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="{resource.value}.{format.value}"'}
+    replica = route_request(request) # whole-table scans are what replicas are for
+    sessionmaker = replica.sessionmaker if replica is not None else SessionLocal
+    return StreamingResponse(export_body(stmt, EXPORT_SCHEMAS[resource], format, sessionmaker), media_type=media_type, headers=headers)
+
+'''
+Change feed
+'''
+
+@app.get("/events", tags=["Events"], summary="Server-sent events for the given topics")
+async def event_stream(
+    request: Request,
+    topics: str = Query(..., description="Comma separated, e.g. posts,post:5:comments"),
+    last_event_id: Optional[str] = None, # resumes after this event; browsers send the Last-Event-ID header instead
+):
+    subscription = bus.subscribe(parse_topics(topics), request.headers.get("last-event-id") or last_event_id)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(sse_stream(bus, subscription), media_type="text/event-stream", headers=headers)
+
+@app.websocket("/ws/events")
+async def event_socket(websocket: WebSocket, topics: str, last_event_id: Optional[str] = None):
+    await websocket.accept()
+    try:
+        await websocket_stream(bus, bus.subscribe(parse_topics(topics), last_event_id), websocket)
+    except WebSocketDisconnect:
+        pass
@@ -1,14 +1,17 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, Table
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, Table, Index, PrimaryKeyConstraint, select, update, and_, func, table, column
+from sqlalchemy.orm import declarative_base, relationship, aliased
 import enum
 from datetime import datetime
 
 Base = declarative_base()
 
+# (post_id, tag_id) primary key serves post -> tags; the reverse index serves tag -> posts
 tag_post_association = Table(
         'tag_post_association', Base.metadata,
         Column('tag_id', Integer, ForeignKey('tags.id')),
-        Column('post_id', Integer, ForeignKey('posts.id'))
+        Column('post_id', Integer, ForeignKey('posts.id')),
+        PrimaryKeyConstraint('post_id', 'tag_id'),
+        Index('ix_tag_post_association_tag_id_post_id', 'tag_id', 'post_id'),
     )
 
 class PostStatus(enum.Enum):
@@ -27,6 +30,7 @@ class User(Base):
     bio = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     is_admin = Column(Boolean, default=False)
+    post_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     posts = relationship("Post", back_populates="author")
     comments = relationship("Comment", back_populates="author")
@@ -43,12 +47,21 @@ class Post(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     author_id = Column(Integer, ForeignKey("users.id"))
     category_id = Column(Integer, ForeignKey("categories.id"))
+    comment_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     author = relationship("User", back_populates="posts")
     comments = relationship("Comment", back_populates="post")
     category = relationship("Category", back_populates="posts")
     tags = relationship('Tag', secondary=tag_post_association, back_populates='posts')
 
+    # Keyset pagination walks (publication_date, id), optionally within a status, author or category
+    __table_args__ = (
+        Index("ix_posts_publication_date_id", "publication_date", "id"),
+        Index("ix_posts_status_publication_date_id", "status", "publication_date", "id"),
+        Index("ix_posts_author_id_publication_date_id", "author_id", "publication_date", "id"),
+        Index("ix_posts_category_id_publication_date_id", "category_id", "publication_date", "id"),
+    )
+
 class Comment(Base):
     __tablename__ = "comments"
     
@@ -58,16 +71,40 @@ class Comment(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     author_id = Column(Integer, ForeignKey("users.id"))
     post_id = Column(Integer, ForeignKey("posts.id"))
+    parent_id = Column(Integer, ForeignKey("comments.id"), nullable=True)
+    path = Column(String, nullable=True) # materialized path, see comment_path()
+    depth = Column(Integer, nullable=False, default=0, server_default="0")
+    reply_count = Column(Integer, nullable=False, default=0, server_default="0") # direct replies only
 
     author = relationship("User", back_populates="comments")
     post = relationship("Post", back_populates="comments")
 
+    # (post_id, path) serves whole threads and subtrees as one range, (post_id, parent_id, id) one level of replies
+    __table_args__ = (
+        Index("ix_comments_post_id_id", "post_id", "id"),
+        Index("ix_comments_author_id", "author_id"),
+        Index("ix_comments_post_id_path", "post_id", "path"),
+        Index("ix_comments_post_id_parent_id_id", "post_id", "parent_id", "id"),
+    )
+
+# A comment's path is its ancestors' ids followed by its own, each zero-padded and "/"-terminated,
+# e.g. "0000000012/0000000045/". Sorting by path lists every thread depth-first, replies by id.
+COMMENT_PATH_WIDTH = 10
+
+def comment_path(parent_path: str | None, id: int) -> str:
+    return f"{parent_path or ''}{id:0{COMMENT_PATH_WIDTH}d}/"
+
+def comment_subtree(path: str):
+    # "/" sorts right before "0", so a comment and all of its replies lie in [path, path[:-1] + "0")
+    return and_(Comment.path >= path, Comment.path < path[:-1] + "0")
+
 class Category(Base):
     __tablename__ = "categories"
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, nullable=False)
     slug = Column(String, unique=True, nullable=True)
+    post_count = Column(Integer, nullable=False, default=0, server_default="0")
     
     posts = relationship("Post", back_populates="category")
 
@@ -76,5 +113,56 @@ class Tag(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, nullable=False)
+    post_count = Column(Integer, nullable=False, default=0, server_default="0")
     
-    posts = relationship('Post', secondary=tag_post_association, back_populates='tags')
\ No newline at end of file
+    posts = relationship('Post', secondary=tag_post_association, back_populates='tags')
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    # either a single token (logout) or every token of a user issued before revoked_at (credential or role change);
+    # rows are only needed until the tokens they cover have expired anyway
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String, nullable=True)
+    user_id = Column(Integer, nullable=True)
+    revoked_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+# Counter columns are maintained incrementally by crud.py; these recount them from scratch.
+# Each only touches rows whose stored value drifted and returns one id per corrected row: the row's own,
+# or for comments the post whose cached comment list shows them.
+def counter_rebuilds():
+    reply = aliased(Comment)
+    counts = {
+        Post.comment_count: (select(func.count()).where(Comment.post_id == Post.id), Post.id),
+        User.post_count: (select(func.count()).where(Post.author_id == User.id), User.id),
+        Category.post_count: (select(func.count()).where(Post.category_id == Category.id), Category.id),
+        Tag.post_count: (select(func.count()).where(tag_post_association.c.tag_id == Tag.id), Tag.id),
+        Comment.reply_count: (select(func.count()).select_from(reply).where(reply.parent_id == Comment.id), Comment.post_id),
+    }
+    return {
+        f"{counter.class_.__tablename__}.{counter.key}": (
+            update(counter.class_)
+            .where(counter != count.scalar_subquery())
+            .values({counter.key: count.scalar_subquery()})
+            .returning(returned)
+            .execution_options(synchronize_session=False)
+        )
+        for counter, (count, returned) in counts.items()
+    }
+
+# External-content FTS5 index over posts.title/content, kept in sync by triggers
+# so every write path (ORM, bulk or raw SQL) updates it. SQLite only.
+POSTS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5("
+    "title, content, content='posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_ai AFTER INSERT ON posts BEGIN "
+    "INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_ad AFTER DELETE ON posts BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_au AFTER UPDATE OF title, content ON posts BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+)
+
+posts_fts = table("posts_fts", column("rowid"), column("title"), column("content"))
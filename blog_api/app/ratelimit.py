@@ -0,0 +1,204 @@
+import json
+import logging
+import math
+import os
+import time
+from jose import JWTError
+from starlette.routing import Match
+from auth import decode_token
+from cache import TTLCache
+from instrumentation import current_stats
+
+try:
+    import redis.asyncio as redis
+except ImportError: # optional shared backend
+    redis = None
+
+logger = logging.getLogger("blog_api.ratelimit")
+
+# every client gets one bucket per route: RATE_LIMIT_BURST tokens, refilled at RATE_LIMIT_RATE per second
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", 20))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", 40))
+RATE_LIMIT_SIZE = int(os.getenv("RATE_LIMIT_SIZE", 100000))
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL")
+# requests a worker handles at once before answering 503, 0 disables
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 256))
+
+# tokens a request takes from its bucket, by route template; anything else costs 1
+ROUTE_COSTS = {
+    "POST /login": 10,               # bcrypt
+    "POST /users/": 10,
+    "PUT /users/{username}": 5,
+    "GET /users/": 5,                # unbounded lists
+    "GET /comments/": 5,
+    "GET /export/{resource}": 10,
+    "POST /posts/bulk": 10,
+    "PATCH /posts/tags/bulk": 5,
+    "POST /admin/counters/rebuild": 10,
+    "GET /posts/search": 2,
+}
+
+# never limited, so monitoring keeps working while the API sheds load
+EXEMPT_PATHS = {"/metrics"}
+# long-lived streams: rate limited when opened, but not counted as in flight for as long as they stay open
+STREAM_PATHS = {"/events"}
+
+'''
+Token buckets
+'''
+
+class MemoryBuckets:
+    """Buckets of this worker only. A bucket left alone long enough to refill is simply dropped."""
+
+    def __init__(self, rate: float, burst: float, maxsize: int):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = TTLCache(maxsize=maxsize, ttl=burst / rate)
+
+    async def take(self, key: str, cost: float) -> float:
+        # 0 if the request may go ahead, otherwise the seconds until the bucket holds enough tokens
+        now = time.monotonic()
+        tokens, last = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        wait = 0.0 if tokens >= cost else (cost - tokens) / self.rate
+        if not wait:
+            tokens -= cost
+        self.buckets.set(key, (tokens, now))
+        return wait
+
+    def stats(self) -> dict:
+        return {"backend": "memory", **self.buckets.stats()}
+
+# refill and take in one atomic step, so every worker sees the same bucket
+TAKE_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local tokens = tonumber(bucket[1]) or burst
+local last = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+class RedisBuckets:
+    """Redis-compatible backend so limits hold across every worker."""
+
+    def __init__(self, url: str, rate: float, burst: float, prefix: str = "blog:ratelimit:"):
+        self.client = redis.from_url(url)
+        self.take_script = self.client.register_script(TAKE_SCRIPT)
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self.errors = 0
+
+    async def take(self, key: str, cost: float) -> float:
+        try:
+            return float(await self.take_script(keys=[self.prefix + key], args=[self.rate, self.burst, cost, time.time()]))
+        except redis.RedisError:
+            # an unreachable limiter must not take the API down with it
+            self.errors += 1
+            logger.warning("rate limit backend unavailable, letting the request through", exc_info=True)
+            return 0.0
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "errors": self.errors}
+
+if RATE_LIMIT_URL and redis is None:
+    raise RuntimeError("RATE_LIMIT_URL is set but the 'redis' package is not installed")
+
+def make_buckets():
+    if RATE_LIMIT_RATE <= 0:
+        return None
+    if RATE_LIMIT_URL:
+        return RedisBuckets(RATE_LIMIT_URL, RATE_LIMIT_RATE, RATE_LIMIT_BURST)
+    return MemoryBuckets(RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_SIZE)
+
+'''
+Middleware
+'''
+
+class AdmissionControl:
+    """Counters and limits shared by the middleware and GET /admin/metrics."""
+
+    def __init__(self, buckets=None, max_in_flight: int = MAX_IN_FLIGHT):
+        self.buckets = buckets
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.shed = 0
+        self.limited = 0
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "shed": self.shed,
+            "limited": self.limited,
+            "buckets": self.buckets.stats() if self.buckets is not None else None,
+        }
+
+admission = AdmissionControl(make_buckets(), MAX_IN_FLIGHT)
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware: sheds load past MAX_IN_FLIGHT with 503, then charges the client's bucket for the route or answers 429."""
+
+    def __init__(self, app, routes: list, control: AdmissionControl = admission):
+        self.app = app
+        self.routes = routes # the application's live route list, matched to find the route template
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        control = self.control
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+        counted = scope["path"] not in STREAM_PATHS
+        if counted and control.max_in_flight and control.in_flight >= control.max_in_flight:
+            control.shed += 1
+            return await reject(send, 503, "Server busy, try again shortly", 1)
+        control.in_flight += counted
+        try:
+            if control.buckets is not None:
+                route = self.route_for(scope)
+                wait = await control.buckets.take(f"{client_key(scope)}|{route}", ROUTE_COSTS.get(route, 1))
+                if wait:
+                    control.limited += 1
+                    stats = current_stats.get()
+                    if stats is not None:
+                        stats.route = route.split(" ", 1)[1] # label the 429 in /metrics with the route it was aimed at
+                    return await reject(send, 429, "Too many requests", math.ceil(wait))
+            await self.app(scope, receive, send)
+        finally:
+            control.in_flight -= counted
+
+    def route_for(self, scope) -> str:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return f"{scope['method']} {route.path}"
+        return f"{scope['method']} unmatched"
+
+def client_key(scope) -> str:
+    # a verified token's user where there is one, so users behind one address don't share a budget
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            try:
+                return "user:" + str(decode_token(value[7:].decode("latin-1")).get("sub"))
+            except JWTError:
+                break
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+async def reject(send, status: int, detail: str, retry_after: int):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, retry_after)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
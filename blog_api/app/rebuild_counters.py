@@ -0,0 +1,27 @@
+"""Recount Post.comment_count and the post_count columns of users, categories and tags.
+
+The API keeps these counters up to date itself; run this after writing to the
+database behind its back (raw SQL, restores), or schedule it as a safety net:
+
+    python rebuild_counters.py
+
+Admins can do the same through POST /admin/counters/rebuild.
+"""
+import asyncio
+import json
+
+from crud import rebuild_counters
+from database import SessionLocal, create_tables, engine
+
+
+async def main():
+    await create_tables()
+    async with SessionLocal() as db:
+        corrected = await rebuild_counters(db)
+        await db.commit()
+    await engine.dispose()
+    print(json.dumps({"corrected": corrected}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
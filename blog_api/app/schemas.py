@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, TypeVar, Generic, Any
 from datetime import datetime
 from enum import Enum
@@ -11,6 +11,17 @@ class PostStatus(str, Enum):
     draft = "draft"
     published = "published"
 
+class ExportResource(str, Enum):
+    posts = "posts"
+    comments = "comments"
+    users = "users"
+    categories = "categories"
+    tags = "tags"
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
 # User schemas
 class UserBase(BaseModel):
     username: str
@@ -35,9 +46,9 @@ class UserResponse(UserBase):
     id: int
     created_at: datetime
     is_admin: bool
+    post_count: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Post schemas
 class PostBase(BaseModel):
@@ -50,6 +61,18 @@ class PostBase(BaseModel):
 class PostCreate(PostBase):
     author_id: int
 
+class PostImport(PostCreate):
+    tags: list[str] = [] # tag names, created if they don't exist yet
+
+class PostImportError(BaseModel):
+    index: int
+    detail: Any
+
+class PostImportReport(BaseModel):
+    created: int
+    post_ids: list[int]
+    errors: list[PostImportError]
+
 class PostUpdate(BaseModel):
     title: Optional[str] = None
     slug: Optional[str] = None
@@ -62,9 +85,39 @@ class PostResponse(PostBase):
     publication_date: datetime
     author_id: int
     category_id: int
+    comment_count: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+class UserSummary(BaseModel):
+    id: int
+    username: str
+    first_name: Optional[str]
+    last_name: Optional[str]
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class CategorySummary(BaseModel):
+    id: int
+    name: str
+    slug: Optional[str]
+
+    model_config = ConfigDict(from_attributes=True)
+
+class TagSummary(BaseModel):
+    id: int
+    name: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+class PostExpandedResponse(PostResponse):
+    author: Optional[UserSummary]
+    category: Optional[CategorySummary]
+    tags: list[TagSummary]
+
+class PostSearchResult(PostResponse):
+    rank: float
+    snippet: str
 
 # Comment schemas
 class CommentBase(BaseModel):
@@ -73,6 +126,7 @@ class CommentBase(BaseModel):
 class CommentCreate(CommentBase):
     author_id: int
     post_id: int
+    parent_id: Optional[int] = None # reply to this comment, which must be on the same post
 
 class CommentUpdate(BaseModel):
     content: Optional[str] = None
@@ -82,9 +136,11 @@ class CommentResponse(CommentBase):
     created_at: datetime
     author_id: int
     post_id: int
+    parent_id: Optional[int]
+    depth: int
+    reply_count: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Category & Tag
 class CategoryBase(BaseModel):
@@ -101,8 +157,8 @@ class CategoryUpdate(BaseModel):
 class CategoryResponse(CategoryBase):
     id: int
     name: str
-    class Config:
-        orm_mode = True
+    post_count: int
+    model_config = ConfigDict(from_attributes=True)
 
 class TagBase(BaseModel):
     name: str
@@ -116,12 +172,30 @@ class TagUpdate(BaseModel):
 class TagResponse(TagBase):
     id: int
     name: str
-    class Config:
-        orm_mode = True
+    post_count: int
+    model_config = ConfigDict(from_attributes=True)
 
 '''
 Relational Schemas
 '''
 
 class PostTagsUpdate(BaseModel):
-    tag_ids: list[int]
\ No newline at end of file
+    tag_ids: list[int]
+class PostTagsDelta(BaseModel):
+    add: list[int] = []
+    remove: list[int] = []
+
+class PostTagsBulkItem(BaseModel):
+    post_id: int
+    tag_ids: Optional[list[int]] = None # replaces the post's tags; add/remove are applied on top
+    add: list[int] = []
+    remove: list[int] = []
+
+class PostTagsBulkUpdate(BaseModel):
+    items: list[PostTagsBulkItem]
+
+class PostTagsResult(BaseModel):
+    post_id: int
+    tag_ids: list[int]
+    added: list[int]
+    removed: list[int]
@@ -1,3 +1,8 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException
 from passlib.context import CryptContext
 from passlib.exc import UnknownHashError
 
@@ -14,4 +19,83 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
     except Exception as e:
         print(f"An unexpected error occurred during password verification: {e}")
-        return False
\ No newline at end of file
+        return False
+
+'''
+Off-loop password hashing
+'''
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop with a bounded number of pending jobs.
+
+    mode is "process" (dedicated worker processes), "thread" (bcrypt releases
+    the GIL while hashing) or "inline" (run on the caller, for debugging).
+    """
+
+    def __init__(self, mode: str = "process", workers: int = 2, max_pending: int = 8):
+        self.mode = mode
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._executor = None
+
+    def start(self):
+        if self._executor is None and self.mode == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        elif self._executor is None and self.mode == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Too many password operations in progress", headers={"Retry-After": "1"})
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        started = time.perf_counter()
+        try:
+            if self.mode == "inline":
+                return fn(*args)
+            self.start()
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.pending -= 1
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_latency_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            "max_latency_ms": round(self.max_seconds * 1000, 2),
+        }
+
+_workers = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+password_hasher = PasswordHasher(
+    mode=os.getenv("PASSWORD_HASH_MODE", "process"),
+    workers=_workers,
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", _workers * 4)),
+)
+
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.run(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(verify_password, plain_password, hashed_password)
@@ -0,0 +1,33 @@
+import os
+from fastapi import Response
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError: # optional, pydantic_core's encoder is used instead
+    orjson = None
+
+# Opt-in: list endpoints select only their response model's columns and encode the rows straight to JSON,
+# skipping the per-row ORM objects and the response_model validation FastAPI would otherwise run
+FAST_JSON = os.getenv("FAST_JSON", "").lower() in ("1", "true", "yes")
+
+def response_columns(model, schema: type[BaseModel]) -> list:
+    # the ORM columns backing each field of a flat response schema, in field order
+    return [getattr(model, field).label(field) for field in schema.model_fields]
+
+def encode_rows(rows) -> bytes:
+    # rows come from select(*response_columns(...)), so their keys already are the response fields
+    fields = rows[0]._fields if rows else ()
+    items = [dict(zip(fields, row)) for row in rows]
+    return orjson.dumps(items) if orjson is not None else to_json(items)
+
+class FastJSONResponse(Response):
+    """JSON response whose body is rendered by orjson (or pydantic_core) without response_model validation."""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return orjson.dumps(content) if orjson is not None else to_json(content)